@@ -0,0 +1,238 @@
+try:
+  import argparse
+  import copy
+  import json
+  import omCommon
+  import omMock
+  import omProxy
+  import os
+  import subprocess
+  import sys
+  import tempfile
+  import timeit
+  from time import monotonic
+except ImportError as e:
+  print(e)
+  exit(1)
+
+# Create a synthetic automation config with the desired number of processes, three members per replica set
+def syntheticConfig(processCount):
+  config = {
+    'processes': [],
+    'replicaSets': [],
+    'sharding': [],
+    'backupVersions': [],
+    'monitoringVersions': []
+  }
+  for i in range(processCount):
+    replicaSetName = 'rs' + str(i // 3)
+    fqdn = 'mongod-%s.mongodb.svc.cluster.local' % i
+    if i % 3 == 0:
+      config['replicaSets'].append(omCommon.createReplicaSet(replicaSetName))
+    process = omCommon.createProcessMember(fqdn = fqdn, subDomain = 'bench', port = 27017, replicaSetName = replicaSetName, mongoDBVersion = '4.4.5-ent')
+    process['name'] = replicaSetName + '_' + str(i)
+    config['processes'].append(process)
+    member = omCommon.createReplicaSetMember(replicaSetName = replicaSetName)
+    member['_id'] = i % 3
+    member['host'] = process['name']
+    config['replicaSets'][-1]['members'].append(member)
+    config['backupVersions'].append({'hostname': fqdn})
+    config['monitoringVersions'].append({'hostname': fqdn})
+  return config
+
+# Time a function over a number of runs against fresh copies of the config, returns milliseconds per run
+def timeOver(config, function, runs):
+  copies = [copy.deepcopy(config) for i in range(runs)]
+  return timeit.timeit(lambda: function(copies.pop()), number = runs) / runs * 1000
+
+# Microbenchmark of the automation config model
+def modelBenchmark(sizes, runs):
+  print("%-10s %-14s %-14s %-14s %-14s" % ('processes', 'index (ms)', 'replace (ms)', 'add (ms)', 'batch30 (ms)'))
+  for size in sizes:
+    config = syntheticConfig(size)
+    replaceFqdn = 'mongod-%s.mongodb.svc.cluster.local' % (size // 2)
+    replicaSetName = 'rs' + str((size // 2) // 3)
+
+    def register(currentConfig, fqdn, replicaSetName):
+      return omCommon.findAndReplaceMember(fqdn = fqdn, replicaSetName = replicaSetName, currentConfig = currentConfig,
+        rsMemberConfig = omCommon.createReplicaSetMember(replicaSetName = replicaSetName),
+        processMemberConfig = omCommon.createProcessMember(fqdn = fqdn, subDomain = 'bench', port = 27017, replicaSetName = replicaSetName, mongoDBVersion = '4.4.5-ent'))
+
+    def batch(currentConfig):
+      automationConfig = omCommon.AutomationConfig(currentConfig)
+      for i in range(30):
+        register(automationConfig, 'new-%s.mongodb.svc.cluster.local' % i, 'rsNew')
+      return automationConfig.toDict()
+
+    index = timeOver(config, lambda c: omCommon.AutomationConfig(c).toDict(), runs)
+    replace = timeOver(config, lambda c: register(c, replaceFqdn, replicaSetName), runs)
+    add = timeOver(config, lambda c: register(c, 'new.mongodb.svc.cluster.local', 'rsNew'), runs)
+    batched = timeOver(config, batch, runs)
+    print("%-10s %-14.3f %-14.3f %-14.3f %-14.3f" % (size, index, replace, add, batched))
+
+# Check the members registered by the load benchmark are all present exactly once and consistent, returns a list of problems
+def topologyProblems(config, fqdns, replicaSetName):
+  problems = []
+  names = [process['name'] for process in config['processes']]
+  hostnames = [process['hostname'] for process in config['processes']]
+  if len(set(names)) != len(names):
+    problems.append('duplicate process names')
+  for fqdn in fqdns:
+    if hostnames.count(fqdn) != 1:
+      problems.append('%s registered %s times' % (fqdn, hostnames.count(fqdn)))
+  replicaSets = [replicaSet for replicaSet in config['replicaSets'] if replicaSet['_id'] == replicaSetName]
+  if len(replicaSets) != 1:
+    problems.append('%s replica sets named %s' % (len(replicaSets), replicaSetName))
+  else:
+    members = replicaSets[0]['members']
+    if len(set(member['_id'] for member in members)) != len(members):
+      problems.append('duplicate member _ids')
+    if sorted(member['host'] for member in members) != sorted(names):
+      problems.append('replica set members do not match the processes')
+  for section in ['backupVersions', 'monitoringVersions']:
+    if sorted(agent['hostname'] for agent in config[section]) != sorted(fqdns):
+      problems.append('%s do not match the processes' % section)
+  return problems
+
+# Load benchmark, N concurrent deployer runs registering one pod each against a local mock Ops Manager
+def loadBenchmark(pods, latency, errorRate, attempts, mongoDbVersions, certificate, rateLimit = None, maxConcurrent = None, proxyWindow = None):
+  mock = omMock.MockOpsManager(projectID = '5f87840518322b1e72bdff8d', publicKey = 'PUBLIC', privateKey = 'PRIVATE', certificate = certificate, latency = latency, errorRate = errorRate,
+    config = omMock.initialConfig(mongoDbVersions = mongoDbVersions))
+  mock.start()
+  workdir = tempfile.mkdtemp(prefix = 'deployer-benchmark-')
+  configPath = os.path.join(workdir, 'config.json')
+  proxy = None
+  if proxyWindow != None:
+    proxy = omProxy.CoalescingProxy(os.path.join(workdir, 'proxy.sock'), window = proxyWindow)
+    proxy.start()
+  with open(configPath, 'w') as f:
+    json.dump({
+      'omBaseURL': mock.baseurl,
+      'projectID': mock.projectID,
+      'publicKey': mock.publicKey,
+      'privateKey': mock.privateKey,
+      'subDomain': 'bench',
+      'dnsSuffix': 'mongodb.local',
+      'ca_cert_path': certificate or '/dev/null',
+      'port': 27017,
+      'replicaSetName': 'rs0',
+      'mongoDBVersion': '4.4.5-ent',
+      'retryAttempts': attempts,
+      'snapshotDir': os.path.join(workdir, 'snapshots'),
+      'rateLimit': rateLimit,
+      'maxConcurrentRequests': maxConcurrent,
+      'rateLimitStateFile': os.path.join(workdir, 'ratelimit.json'),
+      'proxySocket': os.path.join(workdir, 'proxy.sock') if proxy != None else None
+    }, f)
+
+  fqdns = ['mongod-0-%s.mongod-0-svc.mongodb.svc.cluster.local' % i for i in range(pods)]
+  deployer = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deployer.py')
+  start = monotonic()
+  runs = [subprocess.Popen([sys.executable, deployer, '--config', configPath, fqdn], cwd = workdir, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE) for fqdn in fqdns]
+  failed = 0
+  for run in runs:
+    stderr = run.communicate()[1]
+    if run.returncode != 0:
+      failed += 1
+      lines = stderr.decode().strip().splitlines()
+      if len(lines) > 0:
+        print(lines[-1])
+  elapsed = monotonic() - start
+  mock.stop()
+  if proxy != None:
+    proxy.stop()
+
+  stats = mock.stats()
+  problems = topologyProblems(config = mock.config, fqdns = fqdns, replicaSetName = 'rs0')
+  print("pods:              %s" % pods)
+  print("time to converge:  %.2fs" % elapsed)
+  print("failed runs:       %s" % failed)
+  print("requests:          %s" % stats['requests'])
+  print("request rate:      %.1f/s" % (stats['requests'] / elapsed))
+  print("digest challenges: %s" % stats['challenges'])
+  print("409 conflicts:     %s" % stats['conflicts'])
+  print("injected errors:   %s" % stats['errors'])
+  if proxy != None:
+    print("proxy batches:     %s" % sum(coalescer.batches for coalescer in proxy.coalescers.values()))
+  print("config versions:   %s" % stats['updates'])
+  print("bytes sent:        %s" % stats['bytesSent'])
+  print("bytes received:    %s" % stats['bytesReceived'])
+  print("final topology:    %s" % ('correct' if len(problems) == 0 else '; '.join(problems)))
+  return len(problems) == 0 and failed == 0
+
+# Median wall time of a command in milliseconds, optionally running a setup function before every run
+def medianRun(command, runs, cwd, setup = None):
+  times = []
+  for i in range(runs):
+    if setup != None:
+      setup()
+    start = monotonic()
+    subprocess.run(command, cwd = cwd, stdout = subprocess.DEVNULL, check = True)
+    times.append((monotonic() - start) * 1000)
+  return sorted(times)[len(times) // 2]
+
+# Start-up benchmark of the deployer up to the point it would contact Ops Manager, cold and with a cached plan
+def startupBenchmark(runs):
+  workdir = tempfile.mkdtemp(prefix = 'deployer-benchmark-')
+  configPath = os.path.join(workdir, 'config.json')
+  planDir = os.path.join(workdir, 'plans')
+  with open(configPath, 'w') as f:
+    json.dump({
+      'omBaseURL': 'https://localhost:8443/api/public/v1.0',
+      'projectID': '5f87840518322b1e72bdff8d',
+      'publicKey': 'PUBLIC',
+      'privateKey': 'PRIVATE',
+      'subDomain': 'bench',
+      'dnsSuffix': 'mongodb.local',
+      'ca_cert_path': '/dev/null',
+      'port': 27017,
+      'replicaSetName': 'rs0',
+      'mongoDBVersion': '4.4.5-ent',
+      'priority': dict(('mongod-0-%s' % i, 2) for i in range(50)),
+      'planCacheDir': planDir
+    }, f)
+
+  def clearPlans():
+    for plan in os.listdir(planDir) if os.path.isdir(planDir) else []:
+      os.remove(os.path.join(planDir, plan))
+
+  deployer = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deployer.py'), '--config', configPath, '--plan-only', 'mongod-0-7.mongod-0-svc.mongodb.svc.cluster.local']
+  interpreter = medianRun([sys.executable, '-c', 'pass'], runs = runs, cwd = workdir)
+  requests = medianRun([sys.executable, '-c', 'import requests'], runs = runs, cwd = workdir)
+  cold = medianRun(deployer, runs = runs, cwd = workdir, setup = clearPlans)
+  warm = medianRun(deployer, runs = runs, cwd = workdir)
+  print("%-28s %8.1f ms" % ('interpreter', interpreter))
+  print("%-28s %8.1f ms" % ('interpreter + requests', requests))
+  print("%-28s %8.1f ms" % ('deployer plan, cold', cold))
+  print("%-28s %8.1f ms" % ('deployer plan, cached', warm))
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Benchmarks for the deployer')
+  subparsers = parser.add_subparsers(dest = 'benchmark', required = True)
+  model = subparsers.add_parser('model', help = 'microbenchmark of the indexed automation config model')
+  model.add_argument('--sizes', type = int, nargs = '+', default = [100, 1000, 10000], help = 'number of processes in each synthetic config')
+  model.add_argument('--runs', type = int, default = 20, help = 'number of runs per measurement')
+  load = subparsers.add_parser('load', help = 'concurrent deployer runs against a local mock Ops Manager')
+  load.add_argument('--pods', type = int, default = 50, help = 'number of concurrent deployer runs, defaults to `50`')
+  load.add_argument('--latency', type = float, default = 0.02, help = 'mean injected latency of every request in seconds, defaults to `0.02`')
+  load.add_argument('--error-rate', dest = 'errorRate', type = float, default = 0, help = 'fraction of requests answered with `503`, defaults to `0`')
+  load.add_argument('--attempts', type = int, default = 100, help = '`retryAttempts` of each deployer run, defaults to `100`')
+  load.add_argument('--mongodb-versions', dest = 'mongoDbVersions', type = int, default = 200, help = 'number of synthetic `mongoDbVersions` entries in the config, defaults to `200`')
+  load.add_argument('--certificate', help = 'combined PEM certificate and key to serve TLS, also used as the CA certificate')
+  load.add_argument('--rate-limit', dest = 'rateLimit', type = float, help = '`rateLimit` shared by the deployer runs in requests per second, defaults to no limit')
+  load.add_argument('--proxy-window', dest = 'proxyWindow', type = float, help = 'register through a coalescing proxy (`omProxy.py`) with this batching window in seconds, defaults to direct registration')
+  load.add_argument('--max-concurrent', dest = 'maxConcurrent', type = int, help = '`maxConcurrentRequests` shared by the deployer runs, defaults to no limit')
+  startup = subparsers.add_parser('startup', help = 'start-up time of the deployer up to the first request to Ops Manager')
+  startup.add_argument('--runs', type = int, default = 20, help = 'number of runs per measurement, the median is reported')
+  args = parser.parse_args()
+
+  if args.benchmark == 'model':
+    modelBenchmark(sizes = args.sizes, runs = args.runs)
+  elif args.benchmark == 'startup':
+    startupBenchmark(runs = args.runs)
+  elif args.benchmark == 'load':
+    if loadBenchmark(pods = args.pods, latency = args.latency, errorRate = args.errorRate, attempts = args.attempts, mongoDbVersions = args.mongoDbVersions, certificate = args.certificate,
+      rateLimit = args.rateLimit, maxConcurrent = args.maxConcurrent, proxyWindow = args.proxyWindow) == False:
+      exit(1)
+
+if __name__ == "__main__": main()
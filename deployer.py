@@ -1,7 +1,12 @@
 try:
-  from datetime import datetime
+  import argparse
+  import copy
+  import cProfile
+  import hashlib
   import json
   import omCommon
+  import omMetrics
+  import omSnapshot
   import os
   import re
   import socket
@@ -15,9 +20,9 @@ def configChecker(iConfig, args):
   # check if FQDN provided, if not use hostname from os
   if len(args) > 1:
     allowed = re.compile("(?!-)[A-Z\d-]{1,63}(?<!-)$", re.IGNORECASE)
-    iConfig['fqdn'] = sys.argv[1]
+    iConfig['fqdn'] = args[1]
     if iConfig['fqdn'][-1] == ".":
-      iConfig['fqdn'] = fqdn[:-1] # strip exactly one dot from the right, if present
+      iConfig['fqdn'] = iConfig['fqdn'][:-1] # strip exactly one dot from the right, if present
     if all(allowed.match(x) for x in iConfig['fqdn'].split(".")) == False:
       print("%s is not a valid FQDN" % iConfig['fqdn'])
       raise Exception("%s is not a valid FQDN" % iConfig['fqdn'])
@@ -59,46 +64,353 @@ def configChecker(iConfig, args):
 
   return iConfig
 
+# Parse the command line arguments
+def parseArgs(argv):
+  parser = argparse.ArgumentParser(description = 'Deploy and modify MongoDB replica sets via the Ops Manager API')
+  parser.add_argument('fqdn', nargs = '*', help = 'FQDN(s) of the pod(s) to register, defaults to the hostname of the operating system')
+  parser.add_argument('--config', default = sys.path[0] + '/config.json', help = 'path of the `config.json` file, defaults to the directory of `deployer.py`')
+  parser.add_argument('--ordinals', help = 'StatefulSet ordinal range to register, e.g. `0-29`, used with `--fqdn-template` or `fqdnTemplate`')
+  parser.add_argument('--plan-only', dest = 'planOnly', action = 'store_true', help = 'print the process and replica set member documents for the host(s) without contacting Ops Manager')
+  parser.add_argument('--dry-run', dest = 'dryRun', action = 'store_true', help = 'print the changes that would be made, without sending them to Ops Manager')
+  parser.add_argument('--wait', action = 'store_true', help = 'wait until the processes of the registered host(s) have reached goal state, up to `goalStateTimeoutSecs`')
+  parser.add_argument('--wait-project', dest = 'waitProject', action = 'store_true', help = 'with `--wait`, wait until every process of the project has reached goal state')
+  parser.add_argument('--fqdn-template', dest = 'fqdnTemplate', help = 'FQDN template with an `{ordinal}` placeholder, e.g. `mongod-0-{ordinal}.mongod-0-svc.mongodb.svc.cluster.local`')
+  parser.add_argument('--replicas', type = int, help = 'number of StatefulSet replicas, registers ordinals `0` to `replicas - 1`, used with `--fqdn-template` or `fqdnTemplate`')
+  parser.add_argument('--prune', action = 'store_true', help = 'remove the processes, members and agents of the replica set(s) whose hosts are not registered in this run')
+  parser.add_argument('--profile', help = 'write a cProfile dump of the config transform to this path, e.g. for `python -m pstats`')
+  return parser.parse_args(argv[1:])
+
+# Determine the list of FQDNs to register in this run, from the command line or the `hosts` and `ordinals` config keys
+def hostList(iConfig, args = None):
+  hosts = list(iConfig.get('hosts', []))
+  ordinals = iConfig.get('ordinals')
+  template = iConfig.get('fqdnTemplate')
+  if args != None:
+    hosts.extend(args.fqdn)
+    ordinals = args.ordinals or ordinals
+    if args.replicas != None:
+      # without a host the deployer would register the machine it runs on
+      if args.replicas < 1:
+        raise Exception("`--replicas` must be at least `1`, not `%s`" % args.replicas)
+      ordinals = '0-%s' % (args.replicas - 1)
+    template = args.fqdnTemplate or template
+  if ordinals != None:
+    if template == None:
+      raise Exception("`--fqdn-template` or `fqdnTemplate` is required when using `--ordinals` or `--replicas`")
+    start, sep, end = str(ordinals).partition('-')
+    if end == '':
+      end = start
+    if int(end) < int(start):
+      raise Exception("The ordinal range `%s` is empty" % ordinals)
+    for ordinal in range(int(start), int(end) + 1):
+      hosts.append(template.format(ordinal = ordinal))
+  # remove duplicates while keeping the order
+  return list(dict.fromkeys(hosts))
+
+# Create the process and replica set member for a single host
+def buildMember(iConfig, fqdn = None):
+  if fqdn == None:
+    hostConfig = configChecker(iConfig = copy.deepcopy(iConfig), args = [sys.argv[0]])
+  else:
+    hostConfig = configChecker(iConfig = copy.deepcopy(iConfig), args = [sys.argv[0], fqdn])
+
+  # Create the process
+  hostConfig['processMemberConfig'] = omCommon.createProcessMember(fqdn = hostConfig['fqdn'], subDomain = hostConfig['subDomain'], port = hostConfig['port'], mongoDBVersion = hostConfig['mongoDBVersion'], horizons = {'OUTSIDE': hostConfig['outsideName']}, replicaSetName = hostConfig['replicaSetName'],
+    shardedClusterName = hostConfig['shardedClusterName'], deploymentType = hostConfig['deploymentType'], featureCompatibilityVersion = hostConfig.get('featureCompatibilityVersion', '4.4'))
+
+  # Create the replica set member
+  hostConfig['rsMemberConfig'] = omCommon.createReplicaSetMember(replicaSetName = hostConfig['replicaSetName'], priority = hostConfig['priority'], arbiter = hostConfig['arbiter'], horizons = {'OUTSIDE': hostConfig['outsideName']})
+
+  return hostConfig
+
+# Apply the mutations for a single host to the fetched configuration
+def applyMember(currentConfig, hostConfig):
+  return omCommon.findAndReplaceMember(fqdn = hostConfig['fqdn'], replicaSetName = hostConfig['replicaSetName'], currentConfig = currentConfig, rsMemberConfig = hostConfig['rsMemberConfig'], processMemberConfig = hostConfig['processMemberConfig'], monitoring = hostConfig['monitoring'], backup = hostConfig['backup'],
+    shardedClusterName = hostConfig['shardedClusterName'], configServer = hostConfig['configServerReplicaSet'], deploymentType = hostConfig['deploymentType'])
+
+# Build the members for every host, a single host if none are provided, or every host of the `topology` if set
+def buildMembers(iConfig, hosts):
+  if 'topology' in iConfig:
+    if len(hosts) > 0:
+      raise Exception("Hosts cannot be provided with `topology`, list them in the topology instead")
+    return buildTopology(iConfig = iConfig)
+  if len(hosts) == 0:
+    return [buildMember(iConfig = iConfig)]
+  return [buildMember(iConfig = iConfig, fqdn = host) for host in hosts]
+
+# Build the members of a whole sharded cluster from the `topology` key: the config server replica set, then every shard, then the
+# mongos routers. Each group takes its hosts from `hosts` or `ordinals` and `fqdnTemplate`, and may override any other setting, e.g. `port`
+def buildTopology(iConfig):
+  topology = iConfig['topology']
+  for key in ['shardedClusterName', 'configServer', 'shards', 'mongos']:
+    if key not in topology:
+      raise Exception("The `%s` key must exist in the `topology`" % key)
+  if len(topology['shards']) == 0:
+    raise Exception("The `topology` must have at least one shard")
+
+  groups = [dict(topology['configServer'], deploymentType = 'cs')]
+  groups.extend(dict(shard, deploymentType = 'sh') for shard in topology['shards'])
+  groups.append(dict(topology['mongos'], deploymentType = 'ms', replicaSetName = None))
+  replicaSetNames = [group.get('replicaSetName') for group in groups[:-1]]
+  if None in replicaSetNames or len(set(replicaSetNames)) != len(replicaSetNames):
+    raise Exception("The config server and every shard of the `topology` must have a unique `replicaSetName`")
+
+  baseConfig = dict((key, value) for key, value in iConfig.items() if key not in ['topology', 'hosts', 'ordinals', 'fqdnTemplate'])
+  hostConfigs = []
+  for group in groups:
+    groupConfig = dict(baseConfig)
+    groupConfig.update(group)
+    groupConfig['shardedClusterName'] = topology['shardedClusterName']
+    groupConfig['configServerReplicaSet'] = topology['configServer']['replicaSetName']
+    groupConfig['topologyCluster'] = topology['shardedClusterName']
+    hosts = hostList(iConfig = groupConfig)
+    if len(hosts) == 0:
+      raise Exception("The %s group of the `topology` has no hosts" % (group.get('replicaSetName') or 'mongos'))
+    hostConfigs.extend(buildMember(iConfig = groupConfig, fqdn = host) for host in hosts)
+
+  fqdns = [hostConfig['fqdn'] for hostConfig in hostConfigs]
+  if len(set(fqdns)) != len(fqdns):
+    raise Exception("A host is listed more than once in the `topology`")
+  return hostConfigs
+
+# Settings never written to the plan cache, they are merged back from `config.json` when a plan is loaded
+CREDENTIALS = ['publicKey', 'privateKey']
+
+# Build the members for every host, cached on disk keyed by a hash of `config.json`, the hosts and the deployer code.
+# The installed automation agent version is resolved once and cached with the members, the API key is not
+def compilePlan(configBytes, iConfig, hosts):
+  key = hashlib.sha256(configBytes)
+  key.update(json.dumps(hosts).encode())
+  if len(hosts) == 0:
+    key.update(socket.gethostname().encode())
+  for module in [__file__, omCommon.__file__]:
+    key.update(str(os.stat(module).st_mtime_ns).encode())
+  planDir = iConfig.get('planCacheDir', 'plans')
+  planPath = os.path.join(planDir, key.hexdigest() + '.plan.json')
+
+  if os.path.isfile(planPath):
+    try:
+      with open(planPath, 'r') as f:
+        plan = json.load(f)
+      credentials = dict((k, iConfig[k]) for k in CREDENTIALS if k in iConfig)
+      return [dict(hostConfig, **credentials) for hostConfig in plan['hostConfigs']], plan['aaVersion']
+    except (OSError, ValueError, KeyError):
+      pass
+
+  hostConfigs = buildMembers(iConfig = iConfig, hosts = hosts)
+  aaVersion = omCommon.installedAgentVersion()
+
+  # the cache is best effort, e.g. the working directory may be read-only
+  try:
+    os.makedirs(planDir, mode = 0o700, exist_ok = True)
+    cached = [dict((k, v) for k, v in hostConfig.items() if k not in CREDENTIALS) for hostConfig in hostConfigs]
+    # readable by the owner only, the plan holds the rest of `config.json`
+    with os.fdopen(os.open(planPath + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+      json.dump({'hostConfigs': cached, 'aaVersion': aaVersion}, f)
+    os.replace(planPath + '.tmp', planPath)
+    # keep the ten most recent plans, and drop those readable by others, which were cached with the API key
+    plans = sorted((os.path.join(planDir, p) for p in os.listdir(planDir) if p.endswith('.plan.json')), key = os.path.getmtime)
+    for stale in plans[:-10] + [p for p in plans[-10:] if os.stat(p).st_mode & 0o077]:
+      os.remove(stale)
+  except OSError as e:
+    print("Plan not cached: %s" % e)
+  return hostConfigs, aaVersion
+
+# Create the mutation that builds the full config payload from the current configuration, re-applied if Ops Manager reports contention.
+# The mutation returns `None` if nothing changed, and records the changes found in its `changes` attribute.
+# Sharded clusters built from a `topology` are checked to be complete before they are sent.
+# With `prune` the hosts of the replica sets, and the mongos of the sharded clusters, that are not in `hostConfigs` are removed in the same update.
+# Every application is timed as the `transform` phase, and profiled when a `cProfile.Profile` is provided
+def memberMutation(hostConfigs, aaVersion = None, profiler = None, prune = False):
+  def mutate(currentConfig):
+    if profiler != None:
+      profiler.enable()
+    try:
+      with omMetrics.metrics.phase('transform'):
+        return transform(currentConfig)
+    finally:
+      if profiler != None:
+        profiler.disable()
+
+  def transform(currentConfig):
+    # remove keys that are not required, `mongoDbVersions` is normally skipped while parsing.
+    # The `version` is kept so Ops Manager rejects the update with `409` if the config changed since the GET, and it is re-applied
+    currentConfig.pop('mongoDbVersions', None)
+    originalConfig = json.loads(json.dumps(currentConfig))
+
+    # add the automation agent section if missing
+    currentConfig = omCommon.add_missing_aa(currentConfig = currentConfig, opsManagerAddress = hostConfigs[0]['omBaseURL'], aaVersion = aaVersion)
+
+    # all hosts are applied to the one fetched config, indexed once
+    requiredConfig = omCommon.AutomationConfig(currentConfig)
+    for hostConfig in hostConfigs:
+      requiredConfig = applyMember(currentConfig = requiredConfig, hostConfig = copy.deepcopy(hostConfig))
+    if prune == True:
+      requiredConfig = omCommon.pruneMembers(currentConfig = requiredConfig, liveHosts = [h['fqdn'] for h in hostConfigs],
+        replicaSetNames = list(dict.fromkeys(h['replicaSetName'] for h in hostConfigs if h['deploymentType'] != 'ms')),
+        shardedClusterNames = list(dict.fromkeys(h['shardedClusterName'] for h in hostConfigs if h['deploymentType'] == 'ms')))
+    requiredConfig = requiredConfig.toDict()
+    for shardedClusterName in dict.fromkeys(h['topologyCluster'] for h in hostConfigs if 'topologyCluster' in h):
+      problems = omCommon.shardedClusterProblems(config = requiredConfig, shardedClusterName = shardedClusterName)
+      if len(problems) > 0:
+        raise Exception("The %s sharded cluster is not valid: %s" % (shardedClusterName, '; '.join(problems)))
+    omMetrics.metrics.gauge('processes', len(requiredConfig['processes']))
+    omMetrics.metrics.gauge('replicaSets', len(requiredConfig['replicaSets']))
+
+    mutate.changes = omCommon.configDiff(originalConfig, requiredConfig, ignore = ['version'])
+    if len(mutate.changes) == 0:
+      return None
+    return requiredConfig
+  mutate.changes = []
+  return mutate
+
+# Print the changes found by `omCommon.configDiff`
+def printChanges(changes):
+  if len(changes) == 0:
+    print("No changes")
+  for change, path, old, new in changes:
+    if change == '+':
+      print("\033[92m+ %s: %s\033[m" % (path, json.dumps(new, sort_keys = True)))
+    elif change == '-':
+      print("\033[91m- %s: %s\033[m" % (path, json.dumps(old, sort_keys = True)))
+    else:
+      print("\033[93m~ %s: %s -> %s\033[m" % (path, json.dumps(old, sort_keys = True), json.dumps(new, sort_keys = True)))
+
+# The Ops Manager client for a deployment config, rate limited if `rateLimit` or `maxConcurrentRequests` is set
+def omClientFor(iConfig):
+  limiter = None
+  if iConfig.get('rateLimit') != None or iConfig.get('maxConcurrentRequests') != None:
+    limiter = omCommon.RateLimiter(rate = iConfig.get('rateLimit'), burst = iConfig.get('rateBurst'), concurrency = iConfig.get('maxConcurrentRequests'), statePath = iConfig.get('rateLimitStateFile'),
+      leaseSecs = 2 * iConfig.get('requestTimeoutSecs', 10))
+  return omCommon.client(baseurl = iConfig['omBaseURL'], publicKey = iConfig['publicKey'], privateKey = iConfig['privateKey'], ca_cert_path = iConfig['ca_cert_path'],
+    poolSize = iConfig.get('poolSize', 10), timeout = iConfig.get('requestTimeoutSecs', 10), compress = iConfig.get('compressRequests', False), limiter = limiter)
+
+# Priority of the requests of a run with the rate limiter: config servers first, then the pods meant to be primary
+def requestPriority(hostConfigs):
+  if any(h['deploymentType'] == 'cs' for h in hostConfigs):
+    return omCommon.PRIORITY_CONFIG_SERVER
+  if any(h['priority'] > 1 for h in hostConfigs):
+    return omCommon.PRIORITY_PRIMARY
+  return omCommon.PRIORITY_DEFAULT
+
+# Record the config sent as a compressed delta, written in the background
+def snapshot(hostConfigs, requiredConfig):
+  if len(hostConfigs) > 1:
+    snapshotName = 'batch'
+  else:
+    snapshotName = hostConfigs[0]['hostname']
+  return omSnapshot.saveAsync(directory = snapshotDir(hostConfigs[0]), name = snapshotName, config = requiredConfig, retention = hostConfigs[0].get('snapshotRetention', 50))
+
+# The snapshot directory of the project, each project has its own chain of deltas
+def snapshotDir(iConfig):
+  return os.path.join(iConfig.get('snapshotDir', 'snapshots'), iConfig['projectID'])
+
+# Register the hosts through the coalescing proxy (`omProxy.py`) listening on `proxySocket`, returns the reply of the proxy, or `None` if the
+# proxy is not configured or cannot be reached, so the caller registers directly. Registering is idempotent, so a retry is safe
+def proxyRegister(hostConfigs, aaVersion):
+  path = hostConfigs[0].get('proxySocket')
+  if path == None:
+    return None
+  try:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+      connection.settimeout(hostConfigs[0].get('proxyTimeoutSecs', 300))
+      connection.connect(path)
+      connection.sendall(json.dumps({'hostConfigs': hostConfigs, 'aaVersion': aaVersion}).encode() + b'\n')
+      reply = connection.makefile('rb').readline()
+  except OSError as e:
+    print("Proxy at %s not available, registering directly: %s" % (path, e))
+    return None
+  if reply == b'':
+    print("Proxy at %s closed the connection, registering directly" % path)
+    return None
+  reply = json.loads(reply)
+  if reply['ok'] == False:
+    raise Exception("Registration through the proxy failed: %s" % reply['error'])
+  return reply
+
+# Write the metrics of the run to the `metricsFile` (JSON lines) and `metricsTextfile` (Prometheus textfile collector) set in the config
+def writeMetrics(hostConfigs):
+  labels = {'project': hostConfigs[0]['projectID'], 'hostname': 'batch' if len(hostConfigs) > 1 else hostConfigs[0]['hostname']}
+  try:
+    if hostConfigs[0].get('metricsFile') != None:
+      omMetrics.metrics.writeJsonLines(path = hostConfigs[0]['metricsFile'], labels = labels)
+    if hostConfigs[0].get('metricsTextfile') != None:
+      omMetrics.metrics.writePrometheus(path = hostConfigs[0]['metricsTextfile'], labels = labels)
+  except OSError as e:
+    print("Metrics not written: %s" % e)
+
 def main():
   #try:
-    if os.path.isfile(sys.path[0] + '/config.json') == False:
-      print("\033[91mERROR! The `config.json` file must be in the ame directory as `deployer.py`\033[m")
-      raise Exception("\033[91mERROR! The `config.json` file must be in the ame directory as `deployer.py`\033[m")
+    args = parseArgs(sys.argv)
 
-    with open(sys.path[0] + '/config.json', 'r') as f:
-      iDeployConfig = json.load(f)
+    if os.path.isfile(args.config) == False:
+      print("\033[91mERROR! The `config.json` file must be in the ame directory as `deployer.py`, or provided with `--config`\033[m")
+      raise Exception("\033[91mERROR! The `config.json` file must be in the ame directory as `deployer.py`, or provided with `--config`\033[m")
 
-    # check input
-    iDeployConfig = configChecker(iConfig = iDeployConfig, args = sys.argv)
+    with omMetrics.metrics.phase('configLoad'):
+      with open(args.config, 'rb') as f:
+        configBytes = f.read()
+      iDeployConfig = json.loads(configBytes)
 
-    # Create the process
-    processMemberConfig = omCommon.createProcessMember(fqdn = iDeployConfig['fqdn'], subDomain = iDeployConfig['subDomain'], port = iDeployConfig['port'], mongoDBVersion = iDeployConfig['mongoDBVersion'], horizons = {'OUTSIDE': iDeployConfig['outsideName']}, replicaSetName = iDeployConfig['replicaSetName'], 
-    shardedClusterName = iDeployConfig['shardedClusterName'], deploymentType = iDeployConfig['deploymentType'])
+    # check input and build the members for every host, or reuse the cached plan
+    with omMetrics.metrics.phase('plan'):
+      hosts = hostList(iConfig = iDeployConfig, args = args)
+      if args.prune and len(hosts) == 0 and 'topology' not in iDeployConfig:
+        raise Exception("The live hosts must be provided to `--prune`, as FQDNs, `--ordinals`, `--replicas`, `hosts` or a `topology`")
+      hostConfigs, aaVersion = compilePlan(configBytes = configBytes, iConfig = iDeployConfig, hosts = hosts)
+    iDeployConfig = hostConfigs[0]
 
-    # Create the replica set member
-    rsMemberConfig = omCommon.createReplicaSetMember(replicaSetName = iDeployConfig['replicaSetName'], priority = iDeployConfig['priority'], arbiter = iDeployConfig['arbiter'], horizons = {'OUTSIDE': iDeployConfig['outsideName']})
+    if args.planOnly:
+      print(json.dumps([{'processMemberConfig': h['processMemberConfig'], 'rsMemberConfig': h['rsMemberConfig']} for h in hostConfigs], indent = 2, sort_keys = True))
+      return
 
-    # get teh current configuration
-    currentConfig = omCommon.get(baseurl = iDeployConfig['omBaseURL'], endpoint = '/groups/' + iDeployConfig['projectID'] + '/automationConfig', publicKey = iDeployConfig['publicKey'], privateKey = iDeployConfig['privateKey'], ca_cert_path = iDeployConfig['ca_cert_path'])
+    profiler = cProfile.Profile() if args.profile != None else None
+    mutate = memberMutation(hostConfigs, aaVersion = aaVersion, profiler = profiler, prune = args.prune)
+    snapshotThread = None
 
-    # add the automation agent section if missing
-    currentConfig = omCommon.add_missing_aa(currentConfig = currentConfig, opsManagerAddress = iDeployConfig['omBaseURL'])
-
-    # remove keys that are not required
-    currentConfig.pop('mongoDbVersions')
-    currentConfig.pop('version')
-
-    # get the full config payload
-    requiredConfig = omCommon.findAndReplaceMember(fqdn = iDeployConfig['fqdn'], replicaSetName = iDeployConfig['replicaSetName'], currentConfig = currentConfig, rsMemberConfig = rsMemberConfig, processMemberConfig = processMemberConfig, monitoring = iDeployConfig['monitoring'], backup = iDeployConfig['backup'], 
-      shardedClusterName = iDeployConfig['shardedClusterName'], configServer = iDeployConfig['configServerReplicaSet'], deploymentType = iDeployConfig['deploymentType'])
-    f = open((iDeployConfig['hostname'] + '-' + datetime.now().strftime("%Y%m%d%H%M%S") + ".json"), 'w')
-    f.write(json.dumps(requiredConfig, indent=2, sort_keys=True))
-    f.close()
-
-    # Send config
-    reply = omCommon.put(baseurl = iDeployConfig['omBaseURL'], endpoint = '/groups/' + iDeployConfig['projectID'] + '/automationConfig', data = requiredConfig, publicKey = iDeployConfig['publicKey'], privateKey = iDeployConfig['privateKey'], ca_cert_path = iDeployConfig['ca_cert_path'])
-    print("Reply from Ops Manager: %s" % reply)
+    try:
+      # only show what would change
+      if args.dryRun:
+        mutate(omClientFor(iDeployConfig).get('/groups/' + iDeployConfig['projectID'] + '/automationConfig', skip = ['mongoDbVersions'], priority = requestPriority(hostConfigs)))
+        printChanges(mutate.changes)
+        return
+
+      # Send config through the coalescing proxy, batched with the registrations of other pods, or directly if it is not running.
+      # Pruning is always direct, as the live hosts are those of this run only
+      proxied = None
+      if args.prune == False:
+        with omMetrics.metrics.phase('proxy'):
+          proxied = proxyRegister(hostConfigs = hostConfigs, aaVersion = aaVersion)
+      if proxied != None:
+        omMetrics.metrics.gauge('changes', proxied['changes'])
+        print("%s change(s) sent by the proxy in a batch of %s registration(s) (%s attempt(s))" % (proxied['changes'], proxied['batch'], proxied['attempts']))
+      else:
+        # skipped if nothing changed
+        reply, requiredConfig, attempts = omClientFor(iDeployConfig).update(endpoint = '/groups/' + iDeployConfig['projectID'] + '/automationConfig', mutate = mutate,
+          attempts = iDeployConfig.get('retryAttempts', 5), deadline = iDeployConfig.get('retryDeadlineSecs'), skip = ['mongoDbVersions'], priority = requestPriority(hostConfigs))
+        omMetrics.metrics.gauge('changes', len(mutate.changes))
+
+        if reply != None:
+          print("%s change(s) sent" % len(mutate.changes))
+          snapshotThread = snapshot(hostConfigs = hostConfigs, requiredConfig = requiredConfig)
+          print("Reply from Ops Manager: %s (%s attempt(s))" % (reply, attempts))
+
+      # block until the automation agents have applied the config, only on the registered hosts unless the whole project is asked for
+      if args.wait:
+        hostnames = None if args.waitProject else [h['fqdn'] for h in hostConfigs]
+        with omMetrics.metrics.phase('goalState'):
+          latencies = omClientFor(iDeployConfig).waitForGoalState(endpoint = '/groups/' + iDeployConfig['projectID'] + '/automationStatus', deadline = iDeployConfig.get('goalStateTimeoutSecs', 600),
+            hostnames = hostnames)
+        for hostname, latency in sorted(latencies.items(), key = lambda item: item[1]):
+          print("%s reached goal state in %.1fs" % (hostname, latency))
+    finally:
+      # failed runs are recorded too, they are the slow ones
+      if snapshotThread != None:
+        snapshotThread.join()
+      if profiler != None:
+        profiler.dump_stats(args.profile)
+      writeMetrics(hostConfigs)
   #except Exception as e:
   #  print(e)
 
-if __name__ == "__main__": main()
\ No newline at end of file
+if __name__ == "__main__": main()
@@ -0,0 +1,68 @@
+try:
+  import argparse
+  import asyncio
+  import deployer
+  import json
+  import omAsync
+  from concurrent.futures import ThreadPoolExecutor
+  from time import monotonic
+except ImportError as e:
+  print(e)
+  exit(1)
+
+# Reconcile one project config through the same member logic as `deployer.py`
+async def reconcile(configPath, executor, hostConnections):
+  start = monotonic()
+  with open(configPath, 'r') as f:
+    iDeployConfig = json.load(f)
+
+  # check input and build the members for every host in the config, without hosts the members would default to this machine
+  hosts = deployer.hostList(iConfig = iDeployConfig)
+  if len(hosts) == 0:
+    raise Exception("No hosts in %s, `hosts` or `ordinals` and `fqdnTemplate` are required in fleet mode" % configPath)
+  hostConfigs = deployer.buildMembers(iConfig = iDeployConfig, hosts = hosts)
+  iDeployConfig = hostConfigs[0]
+
+  omClient = omAsync.AsyncClient(baseurl = iDeployConfig['omBaseURL'], publicKey = iDeployConfig['publicKey'], privateKey = iDeployConfig['privateKey'], ca_cert_path = iDeployConfig['ca_cert_path'],
+    executor = executor, hostConnections = hostConnections, timeout = iDeployConfig.get('requestTimeoutSecs', 10), compress = iDeployConfig.get('compressRequests', False))
+  reply, requiredConfig, attempts = await omClient.update(endpoint = '/groups/' + iDeployConfig['projectID'] + '/automationConfig', mutate = deployer.memberMutation(hostConfigs),
+    attempts = iDeployConfig.get('retryAttempts', 5), deadline = iDeployConfig.get('retryDeadlineSecs'), skip = ['mongoDbVersions'])
+
+  if reply != None:
+    deployer.snapshot(hostConfigs = hostConfigs, requiredConfig = requiredConfig)
+  return attempts, monotonic() - start
+
+# Reconcile every project config concurrently, a failure of one project does not stop the others
+async def reconcileFleet(configPaths, concurrency, hostConnections):
+  executor = ThreadPoolExecutor(max_workers = concurrency)
+  projects = asyncio.Semaphore(concurrency)
+
+  async def bounded(configPath):
+    async with projects:
+      return await reconcile(configPath, executor = executor, hostConnections = hostConnections)
+
+  results = await asyncio.gather(*[bounded(configPath) for configPath in configPaths], return_exceptions = True)
+  executor.shutdown()
+  return dict(zip(configPaths, results))
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Reconcile the members of many Ops Manager projects concurrently')
+  parser.add_argument('configs', nargs = '+', help = 'project `config.json` files, each listing its members in `hosts` or `ordinals` and `fqdnTemplate`')
+  parser.add_argument('--concurrency', type = int, default = 16, help = 'maximum number of projects reconciled at once, defaults to `16`')
+  parser.add_argument('--host-connections', dest = 'hostConnections', type = int, default = 4, help = 'maximum concurrent requests to each Ops Manager host, defaults to `4`')
+  args = parser.parse_args()
+
+  start = monotonic()
+  results = asyncio.run(reconcileFleet(args.configs, concurrency = args.concurrency, hostConnections = args.hostConnections))
+  failed = 0
+  for configPath, result in results.items():
+    if isinstance(result, Exception):
+      failed += 1
+      print("\033[91mERROR!\033[98m %s: %s\033[m" % (configPath, repr(result)))
+    else:
+      print("%s: reconciled in %.2fs (%s attempt(s))" % (configPath, result[1], result[0]))
+  print("Fleet reconciled in %.2fs, %s of %s project(s) failed" % (monotonic() - start, failed, len(results)))
+  if failed > 0:
+    exit(1)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,93 @@
+# /
+  # asyncio counterpart of the Ops Manager REST API functions in `omCommon`
+  #
+  # The blocking, pooled `omCommon.Client` requests run in a bounded thread pool. A global limit caps the
+  # number of requests in flight and a per Ops Manager host limit caps the connections to each host.
+  #
+  # functions:
+  #   AsyncClient: asyncio Ops Manager client with bounded concurrency
+  #   limiter: return the shared per host concurrency limit
+# /
+
+try:
+  import asyncio
+  import omCommon
+  from urllib.parse import urlparse
+except ImportError as e:
+  print(e)
+  exit(1)
+
+# per Ops Manager host limits, shared by every `AsyncClient` of an event loop
+limits = {}
+
+# /
+  # limiter function to return the shared concurrency limit of an Ops Manager host, creating it if absent
+  #
+  # Inputs:
+  #   baseurl: The URL for Ops Manager, including the base API, e.g. `htts://ops-manager.gov.au:8443/api/public/v1.0`
+  #   hostConnections: maximum concurrent requests to the host, defaults to `4`
+# /
+def limiter(baseurl, hostConnections = 4):
+  host = (asyncio.get_running_loop(), urlparse(baseurl).netloc)
+  if host not in limits:
+    limits[host] = asyncio.Semaphore(hostConnections)
+  return limits[host]
+
+# /
+  # AsyncClient class, asyncio Ops Manager client with bounded concurrency
+  #
+  # Inputs:
+  #   baseurl: The URL for Ops Manager, including the base API, e.g. `htts://ops-manager.gov.au:8443/api/public/v1.0`
+  #   ca_cert_path: The absolute path, including file name, of the CA certificate
+  #   privateKey: The private key portion of the Ops Manager API Access Key
+  #   publicKey: The public key portion of the Ops Manager API Access Key
+  #   key: The absolute path to the combined private key and X.509 certificate. OPTIONAL
+  #   executor: thread pool that runs the blocking requests, shared between clients to bound concurrency
+  #   hostConnections: maximum concurrent requests to the Ops Manager host, defaults to `4`
+  #   timeout: timeout in seconds of each request, defaults to `10`
+  #   compress: Boolean to gzip compress PUT payloads, default is `False`
+# /
+class AsyncClient:
+  def __init__(self, baseurl, ca_cert_path, privateKey, publicKey, executor, key = None, hostConnections = 4, timeout = 10, compress = False):
+    self.client = omCommon.client(baseurl = baseurl, ca_cert_path = ca_cert_path, privateKey = privateKey, publicKey = publicKey, key = key, poolSize = hostConnections, timeout = timeout, compress = compress)
+    self.executor = executor
+    self.limit = limiter(baseurl, hostConnections = hostConnections)
+
+  async def run(self, function, *args, **kwargs):
+    async with self.limit:
+      return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: function(*args, **kwargs))
+
+  # GET an endpoint, see `omCommon.get`
+  async def get(self, endpoint, skip = None):
+    return await self.run(self.client.get, endpoint, skip = skip)
+
+  # PUT a payload to an endpoint, see `omCommon.put`
+  async def put(self, endpoint, data, attempts = 1):
+    return await self.run(self.client.put, endpoint, data = data, attempts = attempts)
+
+  # one GET, mutate and PUT of a read-modify-write, see `omCommon.retryUpdate`
+  async def cycle(self, endpoint, mutate, skip = None):
+    currentConfig = await self.get(endpoint, skip = skip)
+    requiredConfig = mutate(currentConfig)
+    # nothing to change, do not create a new config version
+    if requiredConfig == None:
+      return None, currentConfig
+    return await self.put(endpoint, data = requiredConfig), requiredConfig
+
+  # conflict-aware read-modify-write of an endpoint with the retry policy of `omCommon.updatePolicy`. Backoff sleeps do not hold a connection slot
+  async def update(self, endpoint, mutate, attempts = 5, deadline = None, baseDelay = 0.5, maxDelay = 10, skip = None):
+    policy = omCommon.updatePolicy(endpoint, attempts = attempts, deadline = deadline, baseDelay = baseDelay, maxDelay = maxDelay)
+    outcome = None
+    while True:
+      try:
+        step, value = policy.send(outcome)
+      except StopIteration as e:
+        return e.value
+      if step == 'sleep':
+        await asyncio.sleep(value)
+        outcome = None
+        continue
+      try:
+        outcome = await self.cycle(endpoint, mutate, skip = skip)
+      except omCommon.ConflictError as e:
+        outcome = e
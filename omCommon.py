@@ -2,29 +2,587 @@
   # Functions to deploy replica sets to Ops Manager via the API
   #
   # functions:
+  #   ConfigStreamParser: incremental, section-skipping parser of automation config payloads
+  #   encodeBody: compact, optionally gzip compressed, encoding of PUT payloads
+  #   backoff: exponential backoff with full jitter
+  #   updatePolicy: retry policy of a conflict-aware read-modify-write, shared by the blocking and asyncio clients
+  #   retryUpdate: run `updatePolicy` with blocking callables
+  #   RateLimiter: token bucket with a concurrency cap and request priorities, optionally shared between processes
+  #   Client: pooled keep-alive HTTPS session to the Ops Manager REST API
+  #   client: return the shared `Client` for a set of connection settings
   #   get: HTTPS GET method against the Ops Manager REST API
   #   put: HTTPS PUT method against the Ops Manager REST API
+  #   update: conflict-aware read-modify-write of an Ops Manager REST API endpoint
+  #   waitForGoalState: poll the automation status until the automation agents reach goal state
+  #   installedAgentVersion: version of the automation agent installed on disk
   #   add_missing_aa: create the automation agent version section if missing
   #   createProcessMember: function to create a new `processes` member
   #   createReplicaSetMember: function to create a new replica set member
   #   createReplicaSet: function to create a new skeleton replica set config
   #   createShardedCluster: function to create new sharded cluster if absent
+  #   AutomationConfig: indexed in-memory view of an automation config
+  #   configDiff: semantic, order independent, comparison of two automation configs
   #   findAndReplaceMember: function to determine if member exists in config, create if not, replace if exists. Creates the replica set if missing
+  #   pruneMembers: remove the processes, replica set members and agents of hosts that no longer exist
+  #   upgradeWaves: plan a rolling MongoDB version upgrade as waves of processes
+  #   shardedClusterProblems: consistency check of a sharded cluster in an automation config
 # /
 
+# `requests` and `glob` are imported when first needed, so runs that never reach the network do not load them
 try:
-  import glob
-  import requests
+  import fcntl
+  import gzip
+  import io
   import json
+  import omMetrics
+  import os
+  import re
   import socket
   import sys
-  from requests.auth import HTTPDigestAuth
-  from random import randint
-  from time import sleep
+  import threading
+  import zlib
+  from contextlib import contextmanager, nullcontext
+  from random import uniform
+  from time import monotonic, perf_counter, sleep, time
 except ImportError as e:
   print(e)
   exit(1)
 
+# /
+  # ConfigStreamParser class to parse a JSON object incrementally from a stream of byte chunks, one top level
+  #   section at a time. Sections named in `skip` are scanned past without being decoded or held in memory, so
+  #   peak memory is the largest section that is kept rather than the whole document.
+  #
+  # Inputs:
+  #   chunks: iterable of byte chunks, e.g. `resp.iter_content(65536)`
+  #   skip: top level keys to skip, e.g. `['mongoDbVersions']`. OPTIONAL
+# /
+class ConfigStreamParser:
+  # runs of anything other than brackets, including whole strings, are matched in one call
+  fillerPattern = re.compile(rb'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+  stringPattern = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+  scalarPattern = re.compile(rb'[,}\]\s]')
+  whitespace = b' \t\r\n'
+
+  def __init__(self, chunks, skip = ()):
+    self.chunks = iter(chunks)
+    self.skip = set(skip)
+    self.buf = bytearray()
+    self.pos = 0
+    self.mark = None
+
+  # read the next chunk, dropping consumed bytes that are not part of a value being kept
+  def fill(self):
+    keep = min(self.pos if self.mark == None else self.mark, len(self.buf))
+    if keep > 0:
+      del self.buf[:keep]
+      self.pos -= keep
+      if self.mark != None:
+        self.mark -= keep
+    for chunk in self.chunks:
+      if chunk:
+        self.buf += chunk
+        return True
+    return False
+
+  def more(self):
+    if self.fill() == False:
+      raise ValueError("Unexpected end of the automation config")
+
+  # next non-whitespace byte, without consuming it
+  def peek(self):
+    while True:
+      while self.pos < len(self.buf) and self.buf[self.pos] in self.whitespace:
+        self.pos += 1
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      self.more()
+
+  # position of the next match of `pattern`
+  def search(self, pattern):
+    while True:
+      match = pattern.search(self.buf, self.pos)
+      if match:
+        return match.start()
+      self.pos = len(self.buf)
+      self.more()
+
+  def skipString(self):
+    while True:
+      match = self.stringPattern.match(self.buf, self.pos)
+      if match:
+        self.pos = match.end()
+        return
+      # the string continues in the next chunk
+      self.more()
+
+  def skipValue(self):
+    c = self.peek()
+    if c == ord('"'):
+      self.skipString()
+    elif c in b'{[':
+      depth = 0
+      while True:
+        i = self.fillerPattern.match(self.buf, self.pos).end()
+        self.pos = i
+        # end of the buffer or a string that continues in the next chunk
+        if i == len(self.buf) or self.buf[i] == ord('"'):
+          self.more()
+          continue
+        self.pos = i + 1
+        if self.buf[i] in b'{[':
+          depth += 1
+        else:
+          depth -= 1
+          if depth == 0:
+            return
+    else:
+      self.pos = self.search(self.scalarPattern)
+
+  def expect(self, c):
+    if self.peek() != ord(c):
+      raise ValueError("Expected `%s` in the automation config at byte %s" % (c, self.pos))
+    self.pos += 1
+
+  # parse the document, returning a dictionary of the sections that were not skipped
+  def parse(self):
+    result = {}
+    self.expect('{')
+    if self.peek() == ord('}'):
+      return result
+    while True:
+      self.peek()
+      self.mark = self.pos
+      self.expect('"')
+      self.pos -= 1
+      self.skipString()
+      key = json.loads(bytes(self.buf[self.mark:self.pos]))
+      self.expect(':')
+      self.peek()
+      if key in self.skip:
+        self.mark = None
+        self.skipValue()
+      else:
+        self.mark = self.pos
+        self.skipValue()
+        result[key] = json.loads(bytes(self.buf[self.mark:self.pos]))
+      self.mark = None
+      if self.peek() == ord('}'):
+        self.pos += 1
+        return result
+      self.expect(',')
+
+# /
+  # encodeBody function to encode a JSON payload compactly, one top level section at a time, into a seekable
+  #   buffer, optionally gzip compressed. Avoids building the whole document as one string.
+  #
+  # Inputs:
+  #   data: the JSON payload
+  #   compress: Boolean to gzip compress the payload, default is `False`
+# /
+def encodeBody(data, compress = False):
+  body = io.BytesIO()
+  if compress == True:
+    stream = gzip.GzipFile(fileobj = body, mode = 'wb', compresslevel = 6)
+  else:
+    stream = body
+  if isinstance(data, dict):
+    separator = b'{'
+    for key, value in data.items():
+      stream.write(separator + json.dumps(key).encode() + b':' + json.dumps(value, separators = (',', ':')).encode())
+      separator = b','
+    stream.write(b'}' if len(data) > 0 else b'{}')
+  else:
+    stream.write(json.dumps(data, separators = (',', ':')).encode())
+  if compress == True:
+    stream.close()
+  body.seek(0)
+  return body
+
+# /
+  # ConflictError raised when a PUT is still in conflict (`409`) after all attempts
+# /
+class ConflictError(IOError):
+  def __init__(self, *args, response = None):
+    self.response = response
+    IOError.__init__(self, *args)
+
+# /
+  # backoff function to return the delay before the next attempt, exponential with full jitter
+  #
+  # Inputs:
+  #   attempt: the number of the attempt that failed, starting at `1`
+  #   baseDelay: initial backoff ceiling in seconds, doubled on every attempt, defaults to `0.5`
+  #   maxDelay: maximum backoff ceiling in seconds, defaults to `10`
+# /
+def backoff(attempt, baseDelay = 0.5, maxDelay = 10):
+  return uniform(0, min(maxDelay, baseDelay * 2 ** (attempt - 1)))
+
+# /
+  # updatePolicy generator, the retry policy of a conflict-aware read-modify-write, shared by `Client` and `omAsync.AsyncClient`.
+  #   It yields the steps to take, `('cycle', attempt)` for one GET, mutate and PUT and `('sleep', delay)` for a backoff, and is
+  #   sent the outcome of each cycle: the PUT response and the document that was sent, with a `None` response if nothing
+  #   changed, or the `ConflictError` of the PUT. Returns the PUT response, the document and the number of attempts taken.
+  #   Use `retryUpdate` to run it with blocking callables.
+  #
+  # Inputs:
+  #   endpoint: the endpoint being updated, for the messages
+  #   attempts: maximum number of read-modify-write cycles, defaults to `5`
+  #   deadline: seconds after which no further attempt is started. OPTIONAL
+  #   baseDelay: initial backoff ceiling in seconds, doubled on every conflict, defaults to `0.5`
+  #   maxDelay: maximum backoff ceiling in seconds, defaults to `10`
+# /
+def updatePolicy(endpoint, attempts = 5, deadline = None, baseDelay = 0.5, maxDelay = 10):
+  start = monotonic()
+  for attempt in range(1, attempts + 1):
+    omMetrics.metrics.count('attempts')
+    outcome = yield ('cycle', attempt)
+    if not isinstance(outcome, ConflictError):
+      resp, document = outcome
+      # nothing to change, no new config version was created
+      if resp == None:
+        print("No changes to %s, update skipped" % endpoint)
+      else:
+        print("Update of %s succeeded after %s attempt(s)" % (endpoint, attempt))
+      return resp, document, attempt
+    conflict = outcome
+    # full jitter backoff, but never sleep past the deadline
+    delay = backoff(attempt, baseDelay = baseDelay, maxDelay = maxDelay)
+    if deadline != None:
+      remaining = deadline - (monotonic() - start)
+      if remaining <= 0:
+        break
+      delay = min(delay, remaining)
+    if attempt < attempts:
+      with omMetrics.metrics.phase('retrySleep'):
+        yield ('sleep', delay)
+  print("""\033[91mERROR!\033[98m Update of %s still in conflict after %s attempt(s)\033[m""" % (endpoint, attempt))
+  raise ConflictError("Update of %s still in conflict after %s attempt(s)" % (endpoint, attempt), response = conflict.response)
+
+# /
+  # retryUpdate function to run `updatePolicy` with blocking callables
+  #
+  # Inputs:
+  #   cycle: called with the attempt number, does one GET, mutate and PUT and returns the PUT response and the document, a `None`
+  #     response if nothing changed. Raises `ConflictError` if the PUT is rejected
+  #   sleep: called with the backoff delay in seconds
+  #   endpoint, attempts, deadline, baseDelay, maxDelay: see `updatePolicy`
+# /
+def retryUpdate(cycle, sleep, endpoint, attempts = 5, deadline = None, baseDelay = 0.5, maxDelay = 10):
+  policy = updatePolicy(endpoint, attempts = attempts, deadline = deadline, baseDelay = baseDelay, maxDelay = maxDelay)
+  outcome = None
+  while True:
+    try:
+      step, value = policy.send(outcome)
+    except StopIteration as e:
+      return e.value
+    if step == 'sleep':
+      sleep(value)
+      outcome = None
+      continue
+    try:
+      outcome = cycle(value)
+    except ConflictError as e:
+      outcome = e
+
+# request priorities of the `RateLimiter`, lower goes first
+PRIORITY_CONFIG_SERVER = 0
+PRIORITY_PRIMARY = 1
+PRIORITY_DEFAULT = 2
+PRIORITY_POLL = 3
+
+# /
+  # RateLimiter class, a token bucket with a concurrency cap. Every request takes a token and holds a lease while in flight.
+  #   Waiting requests queue by priority, then by arrival. A read-modify-write cycle is admitted as one, taking a token for each of its requests,
+  #   so other deployers cannot slip in between its GET and its PUT. With `statePath` the bucket, leases and queue are kept in a JSON file
+  #   under an exclusive lock, so every process using the same file, e.g. on a node or a shared volume, shares one limit.
+  #   A lease is renewed while its slot is held, however long the requests take, so only the leases and queue entries of processes that
+  #   died expire and a crash cannot block the others.
+  #
+  # Inputs:
+  #   rate: requests per second, defaults to no limit. OPTIONAL
+  #   burst: number of requests that can be sent at once after a quiet period, defaults to `rate`, at least `1`
+  #   concurrency: maximum number of requests in flight, defaults to no limit. OPTIONAL
+  #   statePath: path of the shared state file, defaults to a limit for this process only. OPTIONAL
+  #   leaseSecs: seconds after which a lease that is no longer renewed is considered abandoned, defaults to `60`
+# /
+class RateLimiter:
+  def __init__(self, rate = None, burst = None, concurrency = None, statePath = None, leaseSecs = 60):
+    self.rate = rate
+    self.burst = burst or max(1, rate or 1)
+    self.concurrency = concurrency
+    self.statePath = statePath
+    self.leaseSecs = leaseSecs
+    # equal settings give an equivalent limit, so a client is shared between limiters with equal settings
+    self.settings = (rate, burst, concurrency, statePath, leaseSecs)
+    self.lock = threading.Lock()
+    self.state = None
+
+  # read-modify-write the state, locked between the threads of this process and, with `statePath`, between processes
+  @contextmanager
+  def shared(self):
+    with self.lock:
+      if self.statePath == None:
+        if self.state == None:
+          self.state = {'tokens': self.burst, 'updated': time(), 'leases': {}, 'waiting': {}}
+        yield self.state
+        return
+      with open(self.statePath + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+          with open(self.statePath, 'r') as f:
+            state = json.load(f)
+        except (OSError, ValueError):
+          state = {'tokens': self.burst, 'updated': time(), 'leases': {}, 'waiting': {}}
+        yield state
+        with open(self.statePath + '.tmp', 'w') as f:
+          json.dump(state, f)
+        os.replace(self.statePath + '.tmp', self.statePath)
+
+  # wait for `cost` tokens and a free slot, returns the lease
+  def acquire(self, priority = PRIORITY_DEFAULT, cost = 1):
+    lease = os.urandom(8).hex()
+    since = time()
+    while True:
+      with self.shared() as state:
+        now = time()
+        if self.rate != None:
+          state['tokens'] = min(self.burst, state['tokens'] + (now - state['updated']) * self.rate)
+        state['updated'] = now
+        state['leases'] = dict((k, expiry) for k, expiry in state['leases'].items() if expiry > now)
+        # waiting entries are refreshed on every poll, so one not seen for a while has given up
+        state['waiting'] = dict((k, entry) for k, entry in state['waiting'].items() if entry[2] > now - 5)
+        state['waiting'][lease] = [priority, since, now]
+        ahead = any((entry[0], entry[1]) < (priority, since) for k, entry in state['waiting'].items() if k != lease)
+        free = self.concurrency == None or len(state['leases']) < self.concurrency
+        if ahead == False and free == True and (self.rate == None or state['tokens'] >= min(cost, self.burst)):
+          if self.rate != None:
+            state['tokens'] -= cost
+          state['leases'][lease] = now + self.leaseSecs
+          state['waiting'].pop(lease)
+          return lease
+        if self.rate != None and state['tokens'] < min(cost, self.burst):
+          delay = (min(cost, self.burst) - state['tokens']) / self.rate
+        else:
+          delay = 0.05
+      sleep(min(1, max(0.01, delay)) * uniform(1, 1.2))
+
+  # extend a lease that is still held, it is added back if it expired in the meantime so the slot stays counted
+  def renew(self, lease):
+    with self.shared() as state:
+      state['leases'][lease] = time() + self.leaseSecs
+
+  # release the slot of a lease
+  def release(self, lease):
+    with self.shared() as state:
+      state['leases'].pop(lease, None)
+
+  # hold a slot for the duration of `cost` requests, e.g. `with limiter.slot(PRIORITY_PRIMARY):`. The lease is renewed every third of
+  # `leaseSecs` until the slot is released, e.g. for a read-modify-write held up by retries
+  @contextmanager
+  def slot(self, priority = PRIORITY_DEFAULT, cost = 1):
+    with omMetrics.metrics.phase('rateLimitWait'):
+      lease = self.acquire(priority, cost = cost)
+    released = threading.Event()
+    def renewLease():
+      while released.wait(self.leaseSecs / 3) == False:
+        self.renew(lease)
+    renewer = threading.Thread(target = renewLease, daemon = True)
+    renewer.start()
+    try:
+      yield
+    finally:
+      # stopped first, so a late renewal cannot add the lease back after it is released
+      released.set()
+      renewer.join()
+      self.release(lease)
+
+# /
+  # Client class holding one pooled, keep-alive HTTPS session to Ops Manager. The CA bundle and client
+  #   certificate are loaded once and the digest auth nonce is reused across requests, so only the first
+  #   request pays the TCP/TLS handshake and the `401` digest challenge.
+  #
+  # Inputs:
+  #   baseurl: The URL for Ops Manager, including the base API, e.g. `htts://ops-manager.gov.au:8443/api/public/v1.0`
+  #   ca_cert_path: The absolute path, including file name, of the CA certificate
+  #   privateKey: The private key portion of the Ops Manager API Access Key
+  #   publicKey: The public key portion of the Ops Manager API Access Key
+  #   key: The absolute path to the combined private key and X.509 certificate. OPTIONAL
+  #   poolSize: number of keep-alive connections to hold open, defaults to `10`
+  #   timeout: timeout in seconds of each request, defaults to `10`
+  #   compress: Boolean to gzip compress PUT payloads, disabled automatically if Ops Manager replies `415`, default is `False`
+  #   limiter: `RateLimiter` every request waits on. OPTIONAL
+# /
+class Client:
+  def __init__(self, baseurl, ca_cert_path, privateKey, publicKey, key = None, poolSize = 10, timeout = 10, compress = False, limiter = None):
+    global requests
+    try:
+      import requests
+      from requests.adapters import HTTPAdapter
+      from requests.auth import HTTPDigestAuth
+    except ImportError as e:
+      print(e)
+      exit(1)
+    self.baseurl = baseurl.rstrip('/')
+    self.timeout = timeout
+    self.compress = compress
+    self.limiter = limiter
+    self.session = requests.Session()
+    self.session.auth = HTTPDigestAuth(publicKey, privateKey)
+    # passed with every request as well, as `REQUESTS_CA_BUNDLE` would otherwise override the session setting
+    self.verify = ca_cert_path
+    self.session.verify = ca_cert_path
+    self.session.cert = key
+    adapter = HTTPAdapter(pool_connections = poolSize, pool_maxsize = poolSize)
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+
+  # admission of `cost` requests by the `RateLimiter`, if any. A `priority` of `None` means already admitted
+  def admit(self, priority, cost = 1):
+    if self.limiter == None or priority == None:
+      return nullcontext()
+    return self.limiter.slot(priority, cost = cost)
+
+  # GET an endpoint, see `get`. The slot of the rate limiter is held until the response is read
+  def get(self, endpoint, skip = None, metered = True, priority = PRIORITY_DEFAULT):
+    with self.admit(priority):
+      return self.read(endpoint, skip = skip, metered = metered)
+
+  # GET and parse an endpoint. Time waiting on the network is recorded as the `get` phase and the rest as `parse`
+  def read(self, endpoint, skip = None, metered = True):
+    start = perf_counter()
+    resp = self.session.get(self.baseurl + endpoint, verify = self.verify, timeout = self.timeout, stream = True)
+    network = {'seconds': perf_counter() - start, 'bytes': 0}
+
+    def chunks():
+      iterator = resp.iter_content(65536)
+      while True:
+        chunkStart = perf_counter()
+        chunk = next(iterator, None)
+        network['seconds'] += perf_counter() - chunkStart
+        if chunk == None:
+          return
+        network['bytes'] += len(chunk)
+        yield chunk
+
+    if resp.status_code == 200:
+      group_data = ConfigStreamParser(chunks(), skip = skip or ()).parse()
+      if metered == True:
+        omMetrics.metrics.addPhase('get', network['seconds'])
+        omMetrics.metrics.addPhase('parse', perf_counter() - start - network['seconds'])
+        omMetrics.metrics.gauge('getBytes', network['bytes'])
+      return group_data
+    else:
+      print("""\033[91mERROR!\033[98m GET response was %s, not `200`\033[m""" % resp.status_code)
+      print(resp.text)
+      raise requests.exceptions.RequestException
+
+  # PUT a payload to an endpoint, see `put`
+  def put(self, endpoint, data, attempts = 3, priority = PRIORITY_DEFAULT):
+    for attempt in range(attempts):
+      header = {'Content-Type': 'application/json'}
+      if self.compress == True:
+        header['Content-Encoding'] = 'gzip'
+      body = encodeBody(data, compress = self.compress)
+      omMetrics.metrics.gauge('putBytes', body.getbuffer().nbytes)
+      omMetrics.metrics.count('puts')
+      with self.admit(priority), omMetrics.metrics.phase('put'):
+        resp = self.session.put(self.baseurl + endpoint, verify = self.verify, timeout = self.timeout, data = body, headers = header)
+      if resp.status_code == 200:
+        return resp
+      elif resp.status_code == 415 and self.compress == True:
+        # Ops Manager does not accept compressed payloads, send uncompressed from now on
+        print("Compressed payloads not accepted, sending uncompressed")
+        self.compress = False
+        with self.admit(priority), omMetrics.metrics.phase('put'):
+          resp = self.session.put(self.baseurl + endpoint, verify = self.verify, timeout = self.timeout, data = encodeBody(data), headers = {'Content-Type': 'application/json'})
+        if resp.status_code == 200:
+          return resp
+      if resp.status_code == 409:
+        print("Contention issues: %s" % resp.text)
+        omMetrics.metrics.count('conflicts')
+        if attempt < attempts - 1:
+          with omMetrics.metrics.phase('retrySleep'):
+            sleep(backoff(attempt + 1))
+      else:
+        print("""\033[91mERROR!\033[98m PUT response was %s, not `200`\033[m""" % resp.status_code)
+        print(resp.text)
+        raise requests.exceptions.RequestException
+    raise ConflictError("PUT to %s still in conflict after %s attempts" % (endpoint, attempts), response = resp)
+
+  # conflict-aware read-modify-write of an endpoint, see `update`
+  def update(self, endpoint, mutate, attempts = 5, deadline = None, baseDelay = 0.5, maxDelay = 10, skip = None, priority = PRIORITY_DEFAULT):
+    def cycle(attempt):
+      # the GET and the PUT are admitted together by the rate limiter
+      with self.admit(priority, cost = 2):
+        currentConfig = self.get(endpoint, skip = skip, priority = None)
+        requiredConfig = mutate(currentConfig)
+        # nothing to change, do not create a new config version
+        if requiredConfig == None:
+          return None, currentConfig
+        return self.put(endpoint, data = requiredConfig, attempts = 1, priority = None), requiredConfig
+    return retryUpdate(cycle, sleep, endpoint, attempts = attempts, deadline = deadline, baseDelay = baseDelay, maxDelay = maxDelay)
+
+  # wait for the automation agents to reach goal state, see `waitForGoalState`
+  def waitForGoalState(self, endpoint, deadline = 600, minInterval = 0.5, maxInterval = 15, factor = 1.5, hostnames = None):
+    start = monotonic()
+    interval = minInterval
+    goalVersion = None
+    latencies = {}
+    while True:
+      status = self.get(endpoint, metered = False, priority = PRIORITY_POLL)
+      # the goal version seen first after the PUT includes our change, later changes by others are accepted too
+      if goalVersion == None:
+        goalVersion = status['goalVersion']
+      pending = []
+      for process in status['processes']:
+        if hostnames != None and process['hostname'] not in hostnames:
+          continue
+        if process['lastGoalVersionAchieved'] >= goalVersion:
+          latencies.setdefault(process['hostname'], monotonic() - start)
+        else:
+          pending.append(process['hostname'])
+      # a host not reported yet has not reached goal state either
+      if hostnames != None:
+        reported = set(process['hostname'] for process in status['processes'])
+        pending.extend(hostname for hostname in hostnames if hostname not in reported)
+      if len(pending) == 0:
+        return latencies
+      elapsed = monotonic() - start
+      if elapsed >= deadline:
+        print("""\033[91mERROR!\033[98m Goal state %s not reached after %.1fs by: %s\033[m""" % (goalVersion, elapsed, ', '.join(pending)))
+        raise TimeoutError("Goal state %s not reached after %.1fs by: %s" % (goalVersion, elapsed, ', '.join(pending)))
+      # poll quickly at first, then more slowly
+      sleep(min(interval, deadline - elapsed))
+      interval = min(maxInterval, interval * factor)
+
+  def close(self):
+    self.session.close()
+
+# clients shared by the module level functions, keyed by every setting of the client
+clients = {}
+
+# /
+  # client function to return the shared `Client` for the connection settings, creating it if absent. Clients with different
+  #   pool sizes, timeouts, compression or rate limits are not shared
+  #
+  # Inputs:
+  #   baseurl: The URL for Ops Manager, including the base API, e.g. `htts://ops-manager.gov.au:8443/api/public/v1.0`
+  #   ca_cert_path: The absolute path, including file name, of the CA certificate
+  #   privateKey: The private key portion of the Ops Manager API Access Key
+  #   publicKey: The public key portion of the Ops Manager API Access Key
+  #   key: The absolute path to the combined private key and X.509 certificate. OPTIONAL
+  #   poolSize: number of keep-alive connections to hold open, defaults to `10`
+  #   timeout: timeout in seconds of each request, defaults to `10`
+  #   compress: Boolean to gzip compress PUT payloads, default is `False`
+  #   limiter: `RateLimiter` every request waits on. OPTIONAL
+# /
+def client(baseurl, ca_cert_path, privateKey, publicKey, key = None, poolSize = 10, timeout = 10, compress = False, limiter = None):
+  settings = (baseurl.rstrip('/'), ca_cert_path, privateKey, publicKey, key, poolSize, timeout, compress, None if limiter == None else limiter.settings)
+  if settings not in clients:
+    clients[settings] = Client(baseurl = baseurl, ca_cert_path = ca_cert_path, privateKey = privateKey, publicKey = publicKey, key = key, poolSize = poolSize, timeout = timeout, compress = compress, limiter = limiter)
+  return clients[settings]
+
 # /
   # get function to perform GET calls to a REST API endpoint over HTTPS
   #
@@ -35,16 +593,10 @@ except ImportError as e:
   #   privateKey: The private key portion of the Ops Manager API Access Key
   #   publicKey: The public key portion of the Ops Manager API Access Key
   #   key: The absolute path to the combined private key and X.509 certificate. OPTIONAL
+  #   skip: top level sections to skip while parsing the response, e.g. `['mongoDbVersions']`. OPTIONAL
 # /
-def get(baseurl, endpoint, ca_cert_path, privateKey, publicKey, key = None):
-  resp = requests.get(baseurl.rstrip('/') + endpoint, auth = HTTPDigestAuth(publicKey, privateKey), verify = ca_cert_path, cert = key, timeout = 10)
-  if resp.status_code == 200:
-    group_data = json.loads(resp.text)
-    return group_data
-  else:
-    print("""\033[91mERROR!\033[98m GET response was %s, not `200`\033[m""" % resp.status_code)
-    print(resp.text)
-    raise requests.exceptions.RequestException
+def get(baseurl, endpoint, ca_cert_path, privateKey, publicKey, key = None, skip = None):
+  return client(baseurl = baseurl, ca_cert_path = ca_cert_path, privateKey = privateKey, publicKey = publicKey, key = key).get(endpoint, skip = skip)
 
 # /
   # put function to perform PUT a payload to a REST API endpoint over HTTPS
@@ -57,23 +609,71 @@ def get(baseurl, endpoint, ca_cert_path, privateKey, publicKey, key = None):
   #   privateKey: The private key portion of the Ops Manager API Access Key
   #   publicKey: The public key portion of the Ops Manager API Access Key
   #   key: The absolute path to the combined private key and X.509 certificate. OPTIONAL
+  #   attempts: number of times to send the payload if we have contention, defaults to `3`
 # /
-def put(baseurl, endpoint, data, ca_cert_path, privateKey, publicKey, key = None):
-  header = {'Content-Type': 'application/json'}
-  # Attempt three times if we have contention
-  for i in range(0,2):
-    while True:
-      resp = requests.put(baseurl.rstrip('/') + endpoint, auth=HTTPDigestAuth(publicKey, privateKey), verify = ca_cert_path, cert = key, timeout = 10, data = json.dumps(data), headers = header)
-      if resp.status_code == 200:
-        return resp
-      elif resp.status_code == 409:
-        print("Contention issues: %s" % resp.text)
-        sleep(randint(1,5))
-        continue
-      else:
-        print("""\033[91mERROR!\033[98m PUT response was %s, not `200`\033[m""" % resp.status_code)
-        print(resp.text)
-        raise requests.exceptions.RequestException
+def put(baseurl, endpoint, data, ca_cert_path, privateKey, publicKey, key = None, attempts = 3):
+  return client(baseurl = baseurl, ca_cert_path = ca_cert_path, privateKey = privateKey, publicKey = publicKey, key = key).put(endpoint, data = data, attempts = attempts)
+
+# /
+  # update function to perform a conflict-aware read-modify-write of a REST API endpoint over HTTPS.
+  #   The current document is fetched and passed to `mutate`, the result is PUT. On contention (`409`)
+  #   the document is fetched again and `mutate` re-applied, backing off exponentially with full jitter,
+  #   until `attempts` or `deadline` is exhausted. Raises `ConflictError` if exhausted.
+  #
+  # Inputs:
+  #   baseurl: The URL for Ops Manager, including the base API, e.g. `htts://ops-manager.gov.au:8443/api/public/v1.0`
+  #   endpoint: The desired endpoint starting with a slash, e.g. `/groups/{PROJECT-ID}/automationConfig`
+  #   mutate: function that takes the current document and returns the document to PUT, or `None` to skip the PUT
+  #   ca_cert_path: The absolute path, including file name, of the CA certificate
+  #   privateKey: The private key portion of the Ops Manager API Access Key
+  #   publicKey: The public key portion of the Ops Manager API Access Key
+  #   key: The absolute path to the combined private key and X.509 certificate. OPTIONAL
+  #   attempts: maximum number of read-modify-write cycles, defaults to `5`
+  #   deadline: maximum number of seconds to keep retrying, defaults to no deadline. OPTIONAL
+  #   baseDelay: initial backoff ceiling in seconds, doubled on every conflict, defaults to `0.5`
+  #   maxDelay: maximum backoff ceiling in seconds, defaults to `10`
+  #   skip: top level sections to skip while parsing the fetched document, e.g. `['mongoDbVersions']`. OPTIONAL
+  #
+  # Returns:
+  #   tuple of the PUT response, the document that was sent and the number of attempts taken.
+  #   The response is `None` and the document is the current document if the PUT was skipped
+# /
+def update(baseurl, endpoint, mutate, ca_cert_path, privateKey, publicKey, key = None, attempts = 5, deadline = None, baseDelay = 0.5, maxDelay = 10, skip = None):
+  return client(baseurl = baseurl, ca_cert_path = ca_cert_path, privateKey = privateKey, publicKey = publicKey, key = key).update(endpoint, mutate = mutate, attempts = attempts, deadline = deadline, baseDelay = baseDelay, maxDelay = maxDelay, skip = skip)
+
+# /
+  # waitForGoalState function to poll the automation status of a project until every process has reached the goal
+  #   version seen after the config was pushed. Polls quickly at first and then more slowly, up to a deadline.
+  #   Raises `TimeoutError` if the deadline passes.
+  #
+  # Inputs:
+  #   baseurl: The URL for Ops Manager, including the base API, e.g. `htts://ops-manager.gov.au:8443/api/public/v1.0`
+  #   endpoint: The automation status endpoint, e.g. `/groups/{PROJECT-ID}/automationStatus`
+  #   ca_cert_path: The absolute path, including file name, of the CA certificate
+  #   privateKey: The private key portion of the Ops Manager API Access Key
+  #   publicKey: The public key portion of the Ops Manager API Access Key
+  #   key: The absolute path to the combined private key and X.509 certificate. OPTIONAL
+  #   deadline: maximum number of seconds to wait, defaults to `600`
+  #   minInterval: first polling interval in seconds, defaults to `0.5`
+  #   maxInterval: maximum polling interval in seconds, defaults to `15`
+  #   factor: growth of the polling interval after each poll, defaults to `1.5`
+  #   hostnames: only wait for the processes on these hostnames, including any not reported yet, defaults to every process. OPTIONAL
+  #
+  # Returns:
+  #   dictionary of hostname and the seconds it took the process to reach goal state
+# /
+def waitForGoalState(baseurl, endpoint, ca_cert_path, privateKey, publicKey, key = None, deadline = 600, minInterval = 0.5, maxInterval = 15, factor = 1.5, hostnames = None):
+  return client(baseurl = baseurl, ca_cert_path = ca_cert_path, privateKey = privateKey, publicKey = publicKey, key = key).waitForGoalState(endpoint, deadline = deadline, minInterval = minInterval, maxInterval = maxInterval, factor = factor, hostnames = hostnames)
+
+# /
+  # installedAgentVersion function to return the version of the automation agent installed on disk, `None` if not installed
+# /
+def installedAgentVersion():
+  import glob
+  aaVersion = None
+  for f in glob.glob('/opt/mongodb-mms-automation/versions/mongodb-mms-automation-agent-*'):
+    aaVersion = f.split('-')[-1] + "-1"
+  return aaVersion
 
 # /
   # add_missing_aa funtion to create the automation agent version section if missing from config.
@@ -89,11 +689,10 @@ def put(baseurl, endpoint, data, ca_cert_path, privateKey, publicKey, key = None
 def add_missing_aa(currentConfig, opsManagerAddress, aaVersion = None):
   if 'agentVersion' not in currentConfig:
     if aaVersion == None:
-      for f in glob.glob('/opt/mongodb-mms-automation/versions/mongodb-mms-automation-agent-*'):
-        aaVersion = f.split('-')[-1] + "-1"
+      aaVersion = installedAgentVersion()
     # if we do not have an aaVersion here that means it is not installed, so error out
     if aaVersion == None:
-      raise("The automation agent does not appear to be installed, please install before continuing")
+      raise Exception("The automation agent does not appear to be installed, please install before continuing")
 
     currentConfig['agentVersion'] = {
       "directoryUrl": opsManagerAddress.rstrip('/') + "/download/agent/automation/",
@@ -114,9 +713,10 @@ def add_missing_aa(currentConfig, opsManagerAddress, aaVersion = None):
   #   replicaSetName: name of the replica set
   #   deploymentType: type of member `rs`, `sh`, `cs`, `ms`.
   #   shardedClusterName: Name of the Shard Cluster, required if a member of a sharded cluster
+  #   featureCompatibilityVersion: the feature compatibility version, defaults to `4.4`
   #   
 # /
-def createProcessMember(fqdn, subDomain, port, replicaSetName, mongoDBVersion, horizons = {}, shardedClusterName = None, deploymentType = 'rs'):
+def createProcessMember(fqdn, subDomain, port, replicaSetName, mongoDBVersion, horizons = {}, shardedClusterName = None, deploymentType = 'rs', featureCompatibilityVersion = '4.4'):
   if deploymentType == 'ms' and shardedClusterName == None:
     raise Exception("`shardedClusterName` is required if the deploymentType is `ms`")
   if deploymentType == 'ms':
@@ -161,7 +761,7 @@ def createProcessMember(fqdn, subDomain, port, replicaSetName, mongoDBVersion, h
     "authSchemaVersion": 5,
     "directAttachShouldFilterByFileList": False,
     "disabled": False,
-    "featureCompatibilityVersion": "4.4",
+    "featureCompatibilityVersion": featureCompatibilityVersion,
     "logRotate": {
       "sizeThresholdMB": 1000,
       "timeThresholdHrs": 24
@@ -252,11 +852,229 @@ def createShardedCluster(shardedClusterName, configServerReplicaSet):
   return baseShardConfig
 
 # /
-  # createReplicaSet function to create new replica sets if absent
+  # AutomationConfig class providing an indexed in-memory view of an automation config. Processes, replica sets,
+  #   replica set members, sharded clusters and the backup and monitoring agents are held in dictionaries keyed by
+  #   process name, hostname, replica set `_id`, member `_id` and sharded cluster name, so lookups, upserts and
+  #   removals are O(1). Insertion order is kept, so `toDict` serialises back to the Ops Manager document
+  #   with the entries in their original order.
+  #
+  # Inputs:
+  #   config: the automation config as returned by Ops Manager
+# /
+class AutomationConfig:
+  def __init__(self, config):
+    self.config = config
+    self.processes = {}
+    self.processNames = {}
+    self.replicaSets = {}
+    self.members = {}
+    self.memberHosts = {}
+    self.shardedClusters = {}
+    self.backupVersions = {}
+    self.monitoringVersions = {}
+    for process in config.get('processes', []):
+      self.upsertProcess(process)
+    for replicaSet in config.get('replicaSets', []):
+      self.upsertReplicaSet(replicaSet)
+    for shardedCluster in config.get('sharding', []):
+      self.shardedClusters[shardedCluster['name']] = shardedCluster
+    for bu in config.get('backupVersions', []):
+      self.backupVersions[bu['hostname']] = bu
+    for mon in config.get('monitoringVersions', []):
+      self.monitoringVersions[mon['hostname']] = mon
+
+  # process by hostname, `None` if absent
+  def process(self, hostname):
+    if hostname in self.processNames:
+      return self.processes[self.processNames[hostname]]
+    return None
+
+  # add or replace a process, keyed by its `name`
+  def upsertProcess(self, process):
+    previous = self.process(process['hostname'])
+    if previous != None and previous['name'] != process['name']:
+      self.processes.pop(previous['name'])
+    self.processes[process['name']] = process
+    self.processNames[process['hostname']] = process['name']
+
+  # stable, unique name for a new process: `<replicaSetName>_<short hostname>`, so pods of different StatefulSets with the
+  # same ordinal get different names, with a numeric suffix only if another host has the same short hostname
+  def processNameFor(self, fqdn, replicaSetName):
+    name = replicaSetName + '_' + fqdn.split('.')[0]
+    if name not in self.processes:
+      return name
+    suffix = 1
+    while name + '_' + str(suffix) in self.processes:
+      suffix += 1
+    return name + '_' + str(suffix)
+
+  # remove a process by hostname, returns the removed process or `None`
+  def removeProcess(self, hostname):
+    if hostname not in self.processNames:
+      return None
+    return self.processes.pop(self.processNames.pop(hostname))
+
+  # replica set by `_id`, `None` if absent
+  def replicaSet(self, replicaSetName):
+    return self.replicaSets.get(replicaSetName)
+
+  # add or replace a replica set, keyed by its `_id`
+  def upsertReplicaSet(self, replicaSet):
+    self.replicaSets[replicaSet['_id']] = replicaSet
+    self.members[replicaSet['_id']] = {}
+    self.memberHosts[replicaSet['_id']] = {}
+    for member in replicaSet['members']:
+      self.upsertMember(replicaSet['_id'], member)
+
+  # remove a replica set by `_id`, returns the removed replica set or `None`
+  def removeReplicaSet(self, replicaSetName):
+    self.members.pop(replicaSetName, None)
+    self.memberHosts.pop(replicaSetName, None)
+    return self.replicaSets.pop(replicaSetName, None)
+
+  # replica set member by the process name it hosts, `None` if absent
+  def member(self, replicaSetName, host):
+    if host in self.memberHosts.get(replicaSetName, {}):
+      return self.members[replicaSetName][self.memberHosts[replicaSetName][host]]
+    return None
+
+  # stable, unique member `_id` for a new member: a hash of the full hostname, probing for the next free `_id` in 0-255
+  # only if another member already has it
+  def memberIdFor(self, replicaSetName, fqdn):
+    used = self.members[replicaSetName]
+    start = zlib.crc32(fqdn.encode()) % 256
+    for offset in range(256):
+      if (start + offset) % 256 not in used:
+        return (start + offset) % 256
+    raise Exception("There is no free member `_id` in the %s replica set" % replicaSetName)
+
+  # add or replace a replica set member, keyed by its `_id`
+  def upsertMember(self, replicaSetName, member):
+    self.members[replicaSetName][member['_id']] = member
+    self.memberHosts[replicaSetName][member['host']] = member['_id']
+
+  # remove a replica set member by `_id`, returns the removed member or `None`
+  def removeMember(self, replicaSetName, memberId):
+    member = self.members.get(replicaSetName, {}).pop(memberId, None)
+    if member != None:
+      self.memberHosts[replicaSetName].pop(member['host'], None)
+    return member
+
+  # sharded cluster by name, `None` if absent
+  def shardedCluster(self, shardedClusterName):
+    return self.shardedClusters.get(shardedClusterName)
+
+  # add or replace a sharded cluster, keyed by its `name`
+  def upsertShardedCluster(self, shardedCluster):
+    self.shardedClusters[shardedCluster['name']] = shardedCluster
+
+  # add a shard to a sharded cluster if absent
+  def addShard(self, shardedClusterName, replicaSetName):
+    shards = self.shardedClusters[shardedClusterName]['shards']
+    if not any(shard['_id'] == replicaSetName for shard in shards):
+      shards.append({
+        "tags": [],
+        "_id": replicaSetName,
+        "rs": replicaSetName
+      })
+
+  # enable or disable the backup agent on a host
+  def setBackup(self, hostname, enabled):
+    if enabled == True:
+      self.backupVersions.setdefault(hostname, {"hostname": hostname})
+    else:
+      self.backupVersions.pop(hostname, None)
+
+  # enable or disable the monitoring agent on a host
+  def setMonitoring(self, hostname, enabled):
+    if enabled == True:
+      self.monitoringVersions.setdefault(hostname, {"hostname": hostname})
+    else:
+      self.monitoringVersions.pop(hostname, None)
+
+  # serialise back to the Ops Manager document
+  def toDict(self):
+    self.config['processes'] = list(self.processes.values())
+    for replicaSetName in self.replicaSets:
+      self.replicaSets[replicaSetName]['members'] = list(self.members[replicaSetName].values())
+    self.config['replicaSets'] = list(self.replicaSets.values())
+    self.config['sharding'] = list(self.shardedClusters.values())
+    self.config['backupVersions'] = list(self.backupVersions.values())
+    self.config['monitoringVersions'] = list(self.monitoringVersions.values())
+    return self.config
+
+# lists of the automation config that are compared by key rather than by position
+keyedLists = {
+  'processes': 'name',
+  'replicaSets': '_id',
+  'members': '_id',
+  'sharding': 'name',
+  'shards': '_id',
+  'backupVersions': 'hostname',
+  'monitoringVersions': 'hostname'
+}
+
+# /
+  # configDiff function to compare two automation configs semantically. Processes, replica sets, members,
+  #   sharded clusters, shards and agents are matched by their keys, so their order does not matter.
+  #
+  # Inputs:
+  #   old: the current document
+  #   new: the desired document
+  #   ignore: top level keys not compared, e.g. `['version']`. OPTIONAL
+  #   path: path of the documents, used when recursing. OPTIONAL
+  #
+  # Returns:
+  #   list of changes as tuples of `+`, `-` or `~`, the path, the old value and the new value. Empty if equivalent
+# /
+def configDiff(old, new, ignore = (), path = ''):
+  changes = []
+  if isinstance(old, dict) and isinstance(new, dict):
+    for key in old:
+      if key not in new and not (path == '' and key in ignore):
+        changes.append(('-', (path + '.' + key).lstrip('.'), old[key], None))
+    for key in new:
+      if path == '' and key in ignore:
+        continue
+      if key not in old:
+        changes.append(('+', (path + '.' + key).lstrip('.'), None, new[key]))
+      else:
+        changes.extend(configDiff(old[key], new[key], path = (path + '.' + key).lstrip('.')))
+    return changes
+  if isinstance(old, list) and isinstance(new, list):
+    field = keyedLists.get(path.split('.')[-1].split('[')[0])
+    if field != None and all(isinstance(item, dict) and field in item for item in old + new):
+      oldItems = dict((item[field], item) for item in old)
+      newItems = dict((item[field], item) for item in new)
+      for key in oldItems:
+        if key not in newItems:
+          changes.append(('-', '%s[%s]' % (path, key), oldItems[key], None))
+      for key in newItems:
+        if key not in oldItems:
+          changes.append(('+', '%s[%s]' % (path, key), None, newItems[key]))
+        else:
+          changes.extend(configDiff(oldItems[key], newItems[key], path = '%s[%s]' % (path, key)))
+      return changes
+  if type(old) != type(new) or old != new:
+    changes.append(('~', path, old, new))
+  return changes
+
+# /
+  # findAndReplaceMember function to determine if member exists in config, create if not, replace if exists.
+  #   Creates the replica set and sharded cluster if missing
   #
   # Inputs:
   #   fqdn: the FQDN of the pod, **NOT** the DNS Split Horizon name
   #   replicaSetName: name of the replica set
+  #   currentConfig: current configuration for the project, either the document or an `AutomationConfig`.
+  #     An `AutomationConfig` is returned if one is provided, so many members can be applied without re-indexing
+  #   rsMemberConfig: replica set member, as created by `createReplicaSetMember`
+  #   processMemberConfig: process, as created by `createProcessMember`
+  #   monitoring: Boolean to determine if the monitoring agent is enabled, default is `True`
+  #   backup: Boolean to determine if the backup agent is enabled, default is `True`
+  #   shardedClusterName: Name of the Shard Cluster, required if a member of a sharded cluster
+  #   configServer: name of the config server replica set, required for shard members
+  #   deploymentType: type of member `rs`, `sh`, `cs`, `ms`.
 # /
 def findAndReplaceMember(fqdn, replicaSetName, currentConfig, rsMemberConfig, processMemberConfig, monitoring = True, backup = True, shardedClusterName = None, configServer = None, deploymentType = 'rs'):
   if deploymentType not in ['rs','sh','cs', 'ms']:
@@ -264,133 +1082,194 @@ def findAndReplaceMember(fqdn, replicaSetName, currentConfig, rsMemberConfig, pr
   if deploymentType == 'ms':
     replicaSetName = 'mongos'
 
-  config = currentConfig
-  currentMember = None
-  rsMemberName = None
-  processMemberName = None
-  processMemberList = []
-  rsMemberList = []
-  replicaSetPresent = None
-  replicaSetIds = []
-  shardedClusterPresent = None
-  shardPresent = None
-  shardList = []
-
-  # determine if the member is already in the deployment
-  if 'processes' in config and len(config['processes']) > 0:
-    for member in config['processes']:
-      # add member to list so we can generate a unique member name if required
-      processMemberList.append(member['name'])
-      if member['hostname'] == fqdn:
-        processMemberName = member['name']
-        currentMember = member['name']
-        config['processes'].pop(config['processes'].index(member))
-  processMemberList.sort()
-
-  # add member
-  if currentMember == None and len(processMemberList) > 0:
-    processMemberConfig['name'] = replicaSetName + '_' + str(int(processMemberList[-1].split('_')[-1]) + 1)
-  elif currentMember == None:
-    processMemberConfig['name'] = replicaSetName + '_0'
+  if isinstance(currentConfig, AutomationConfig):
+    config = currentConfig
   else:
-    processMemberConfig['name'] = processMemberName
-  config['processes'].append(processMemberConfig)
+    config = AutomationConfig(currentConfig)
+
+  # determine if the member is already in the deployment, reuse its name if so
+  currentMember = config.removeProcess(fqdn)
+  if currentMember == None:
+    processMemberConfig['name'] = config.processNameFor(fqdn, replicaSetName)
+  else:
+    processMemberConfig['name'] = currentMember['name']
+  config.upsertProcess(processMemberConfig)
 
   if deploymentType != 'ms':
 
-    # Determine if the member is in a replica set
-    if 'replicaSets' in config and len(config['replicaSets']) > 0:
-
-      # go through all the replica seets
-      for replicaSets in range(len(config['replicaSets'])):
-
-        # record the `_id` of each replica set
-        replicaSetIds.append(config['replicaSets'][replicaSets]['_id'])
-
-        # if the replica set `_id` matches the desried replica set name we record the element position
-        if config['replicaSets'][replicaSets]['_id'] == replicaSetName:
-          replicaSetPresent = replicaSets
-
-          # find if our member is in the replica set already and remove if so
-          for member in range(len(config['replicaSets'][replicaSets]['members'])):
-            rsMemberList.append(config['replicaSets'][replicaSets]['members'][member]['_id'])
-
-            # determine the current member and remove it from the array
-            if config['replicaSets'][replicaSets]['members'][member]['host'] == currentMember:
-              rsMemberName = config['replicaSets'][replicaSets]['members'][member]['_id']
-              config['replicaSets'][replicaSets]['members'].pop(member)
-      rsMemberList.sort()
-    else: 
-      # add replica set skeleton
-      rsConfig = createReplicaSet(replicaSetName)
-      config['replicaSets'].append(rsConfig)
-      replicaSetPresent = 0
-
-    if replicaSetPresent == None:
-      # add replica set skeleton
-      replicaSetPresent = len(replicaSetIds)
-      rsConfig = createReplicaSet(replicaSetName)
-      config['replicaSets'].append(rsConfig)
-
-    # add member
-    if rsMemberName == None and len(rsMemberList) > 0:
-      rsMemberConfig['_id'] = int(rsMemberList[-1] + 1)
-    elif rsMemberName == None:
-      rsMemberConfig['_id'] = 0
+    # add replica set skeleton if missing
+    if config.replicaSet(replicaSetName) == None:
+      config.upsertReplicaSet(createReplicaSet(replicaSetName))
+
+    # find if our member is in the replica set already and replace it if so
+    rsMember = None
+    if currentMember != None:
+      rsMember = config.member(replicaSetName, currentMember['name'])
+    if rsMember == None:
+      rsMemberConfig['_id'] = config.memberIdFor(replicaSetName, fqdn)
     else:
-      rsMemberConfig['_id'] = rsMemberName
+      rsMemberConfig['_id'] = config.removeMember(replicaSetName, rsMember['_id'])['_id']
     rsMemberConfig['host'] = processMemberConfig['name']
-
-    # add replica set member to replica set
-    config['replicaSets'][replicaSetPresent]['members'].append(rsMemberConfig)
+    config.upsertMember(replicaSetName, rsMemberConfig)
 
     # add to sharded cluster if required (e.g. if not a replica set or not a config server)
     if shardedClusterName != None and deploymentType == 'sh':
+      if config.shardedCluster(shardedClusterName) == None:
+        config.upsertShardedCluster(createShardedCluster(shardedClusterName, configServer))
+      config.addShard(shardedClusterName, replicaSetName)
+
+  # Setup the backup and monitoring agents, if required
+  config.setBackup(fqdn, backup)
+  config.setMonitoring(fqdn, monitoring)
+
+  if isinstance(currentConfig, AutomationConfig):
+    return config
+  return config.toDict()
+
+# /
+  # pruneMembers function to remove the processes, replica set members and backup and monitoring agents of hosts that are not live,
+  #   e.g. after a StatefulSet is scaled down. Only the replica sets and the mongos of the sharded clusters named are pruned.
+  #   Nothing is removed if a replica set would lose the majority of its voting members or all of its members, or a sharded
+  #   cluster all of its mongos, so a scale-down to that size has to be done in steps.
+  #
+  # Inputs:
+  #   currentConfig: current configuration for the project, either the document or an `AutomationConfig`, the same type is returned
+  #   liveHosts: FQDNs of the hosts that exist
+  #   replicaSetNames: names of the replica sets to prune
+  #   shardedClusterNames: names of the sharded clusters to prune the mongos of. OPTIONAL
+# /
+def pruneMembers(currentConfig, liveHosts, replicaSetNames, shardedClusterNames = ()):
+  if isinstance(currentConfig, AutomationConfig):
+    config = currentConfig
+  else:
+    config = AutomationConfig(currentConfig)
+  liveHosts = set(liveHosts)
+  shards = {}
+  for shardedCluster in config.shardedClusters.values():
+    shards[shardedCluster['configServerReplica']] = shardedCluster['name']
+    for shard in shardedCluster['shards']:
+      shards[shard['rs']] = shardedCluster['name']
+
+  # check every replica set before anything is removed
+  staleHosts = []
+  staleMembers = []
+  for replicaSetName in replicaSetNames:
+    if config.replicaSet(replicaSetName) == None:
+      continue
+    members = list(config.members[replicaSetName].values())
+    stale = [m for m in members if m['host'] not in config.processes or config.processes[m['host']]['hostname'] not in liveHosts]
+    if len(stale) == 0:
+      continue
+    if len(stale) == len(members):
+      if replicaSetName in shards:
+        raise Exception("Pruning would remove every member of %s, which is part of the %s sharded cluster" % (replicaSetName, shards[replicaSetName]))
+      raise Exception("Pruning would remove every member of %s" % replicaSetName)
+    voters = [m for m in members if m['votes'] > 0]
+    remaining = [m for m in voters if m not in stale]
+    if len(remaining) * 2 <= len(voters):
+      raise Exception("Pruning %s of the %s voting members of %s would lose the voting majority, prune in smaller steps" % (len(voters) - len(remaining), len(voters), replicaSetName))
+    staleMembers.extend((replicaSetName, m['_id']) for m in stale)
+    staleHosts.extend(config.processes[m['host']]['hostname'] for m in stale if m['host'] in config.processes)
+    # processes of the replica set that are not members
+    staleHosts.extend(p['hostname'] for p in config.processes.values() if p['args2_6'].get('replication', {}).get('replSetName') == replicaSetName and p['hostname'] not in liveHosts)
+  for shardedClusterName in shardedClusterNames:
+    mongos = [p['hostname'] for p in config.processes.values() if p['processType'] == 'mongos' and p.get('cluster') == shardedClusterName]
+    stale = [hostname for hostname in mongos if hostname not in liveHosts]
+    if len(stale) > 0 and len(stale) == len(mongos):
+      raise Exception("Pruning would remove every mongos of the %s sharded cluster" % shardedClusterName)
+    staleHosts.extend(stale)
+
+  for replicaSetName, memberId in staleMembers:
+    config.removeMember(replicaSetName, memberId)
+  for hostname in dict.fromkeys(staleHosts):
+    config.removeProcess(hostname)
+    config.setBackup(hostname, False)
+    config.setMonitoring(hostname, False)
+
+  if isinstance(currentConfig, AutomationConfig):
+    return config
+  return config.toDict()
+
+# /
+  # upgradeWaves function to plan a MongoDB version upgrade of the processes of an automation config as waves, each meant to be
+  #   one PUT. Config server replica sets go first, then the shards and other replica sets, then the mongos. Within a replica set
+  #   one member is upgraded per wave, lowest priority first, so the intended primary (highest priority) goes last and a voting
+  #   majority stays up. The replica sets of a stage are upgraded side by side, so the number of waves depends on the size of the
+  #   largest replica set, not on the number of processes. Processes already at the version are left out.
+  #
+  # Inputs:
+  #   config: the automation config
+  #   version: the MongoDB version to upgrade to, e.g. `5.0.3-ent`
+  #   replicaSetNames: names of the replica sets to upgrade, defaults to all. OPTIONAL
+  #   shardedClusterNames: names of the sharded clusters whose mongos to upgrade, defaults to all. OPTIONAL
+  #   mongosWaves: number of waves the mongos are spread over, so some always route, defaults to `2`
+  #
+  # Returns:
+  #   list of waves, each a list of process names
+# /
+def upgradeWaves(config, version, replicaSetNames = None, shardedClusterNames = None, mongosWaves = 2):
+  processes = dict((process['name'], process) for process in config.get('processes', []))
+  configServers = set(shardedCluster['configServerReplica'] for shardedCluster in config.get('sharding', []))
+
+  def replicaSetWaves(replicaSets):
+    waves = []
+    for replicaSet in replicaSets:
+      members = sorted(replicaSet['members'], key = lambda m: (m['priority'], m['_id']))
+      pending = [m['host'] for m in members if m['host'] in processes and processes[m['host']]['version'] != version]
+      for i, name in enumerate(pending):
+        if i == len(waves):
+          waves.append([])
+        waves[i].append(name)
+    return waves
+
+  replicaSets = [r for r in config.get('replicaSets', []) if replicaSetNames == None or r['_id'] in replicaSetNames]
+  waves = replicaSetWaves([r for r in replicaSets if r['_id'] in configServers])
+  waves.extend(replicaSetWaves([r for r in replicaSets if r['_id'] not in configServers]))
+
+  mongos = [p['name'] for p in processes.values() if p['processType'] == 'mongos' and p['version'] != version
+    and (shardedClusterNames == None or p.get('cluster') in shardedClusterNames)]
+  size = -(-len(mongos) // max(1, mongosWaves))
+  waves.extend(mongos[i:i + size] for i in range(0, len(mongos), size or 1))
+  return waves
+
+# /
+  # shardedClusterProblems function to check a sharded cluster in an automation config is complete and consistent: the config
+  #   server replica set and every shard exist with members whose processes have the right cluster role, every member is
+  #   a process of the config, and the cluster has at least one mongos
+  #
+  # Inputs:
+  #   config: the automation config
+  #   shardedClusterName: name of the sharded cluster
+  #
+  # Returns:
+  #   list of problems found, empty if none
+# /
+def shardedClusterProblems(config, shardedClusterName):
+  clusters = [c for c in config.get('sharding', []) if c['name'] == shardedClusterName]
+  if len(clusters) != 1:
+    return ["%s sharded clusters named %s" % (len(clusters), shardedClusterName)]
+  problems = []
+  processes = dict((process['name'], process) for process in config.get('processes', []))
+  replicaSets = dict((replicaSet['_id'], replicaSet) for replicaSet in config.get('replicaSets', []))
+
+  def checkReplicaSet(replicaSetName, clusterRole):
+    if replicaSetName not in replicaSets:
+      problems.append("replica set %s does not exist" % replicaSetName)
+      return
+    if len(replicaSets[replicaSetName]['members']) == 0:
+      problems.append("replica set %s has no members" % replicaSetName)
+    for member in replicaSets[replicaSetName]['members']:
+      process = processes.get(member['host'])
+      if process == None:
+        problems.append("member %s of %s is not a process" % (member['host'], replicaSetName))
+      elif process['args2_6'].get('sharding', {}).get('clusterRole') != clusterRole:
+        problems.append("process %s of %s does not have the %s cluster role" % (member['host'], replicaSetName, clusterRole))
 
-      if 'sharding' in config and len(config['sharding']) > 0:
-        # check if our sharded cluster exists
-        for shardedCluster in config['sharding']:
-
-          if shardedCluster['name'] == shardedClusterName:
-            shardedClusterPresent = config['sharding'].index(shardedCluster)
-
-            # Check the shard is present
-            for replicaSets in shardedCluster['shards']:
-              if replicaSets['_id'] == replicaSetName:
-                shardPresent = True
-                break
-      # Create the sharded cluster if it does not exist
-      if shardedClusterPresent == None:
-        config['sharding'].append(createShardedCluster(shardedClusterName, configServer))
-        shardedClusterPresent = len(config['sharding']) - 1
-      # create the shard if not present
-      if shardPresent == None:
-        config['sharding'][shardedClusterPresent]['shards'].append({
-          "tags": [],
-          "_id": replicaSetName,
-          "rs": replicaSetName
-        })
-
-  # Setup the backup agent, if required
-  buPresent = None
-  for bu in config['backupVersions']:
-    if bu['hostname'] == fqdn:
-      buPresent = config['backupVersions'].index(bu)
-      break
-  if backup == True and buPresent == None:
-    config['backupVersions'].append({"hostname": fqdn})
-  if backup == False and buPresent != None:
-    config['backupVersions'].pop(buPresent)
-
-  # Setup monitoring agent, if required
-  monPresent = None
-  for mon in config['monitoringVersions']:
-    if mon['hostname'] == fqdn:
-      monPresent = config['monitoringVersions'].index(mon)
-      break
-  if monitoring == True and monPresent == None:
-    config['monitoringVersions'].append({"hostname": fqdn})
-  if monitoring == False and monPresent != None:
-    config['monitoringVersions'].pop(monPresent)
-
-  return config
\ No newline at end of file
+  checkReplicaSet(clusters[0]['configServerReplica'], 'configsvr')
+  if len(clusters[0]['shards']) == 0:
+    problems.append("%s has no shards" % shardedClusterName)
+  for shard in clusters[0]['shards']:
+    checkReplicaSet(shard['rs'], 'shardsvr')
+  if not any(process['processType'] == 'mongos' and process.get('cluster') == shardedClusterName for process in processes.values()):
+    problems.append("%s has no mongos" % shardedClusterName)
+  return problems
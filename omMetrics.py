@@ -0,0 +1,96 @@
+# /
+  # Functions to record per-phase timings, counters and sizes of a deployer run, written as JSON lines and as a
+  # Prometheus textfile collector file
+  #
+  # functions:
+  #   Metrics: recorder of phase durations, counters and gauges
+  #   metrics: the `Metrics` of the current run, used by `omCommon` and `deployer`
+# /
+
+try:
+  import json
+  import os
+  import threading
+  import time
+  from contextlib import contextmanager
+except ImportError as e:
+  print(e)
+  exit(1)
+
+# /
+  # Metrics class, recorder of phase durations, counters and gauges. Repeated phases, e.g. a GET per retry, are summed.
+# /
+class Metrics:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.start = time.time()
+    self.phases = {}
+    self.counters = {}
+    self.gauges = {}
+
+  # time a phase, e.g. `with metrics.phase('get'):`
+  @contextmanager
+  def phase(self, name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.addPhase(name, time.perf_counter() - start)
+
+  def addPhase(self, name, seconds):
+    with self.lock:
+      self.phases[name] = self.phases.get(name, 0) + seconds
+
+  def count(self, name, value = 1):
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + value
+
+  def gauge(self, name, value):
+    with self.lock:
+      self.gauges[name] = value
+
+  def toDict(self, labels = {}):
+    with self.lock:
+      return {
+        'timestamp': self.start,
+        'labels': dict(labels),
+        'totalSeconds': time.time() - self.start,
+        'phaseSeconds': dict(self.phases),
+        'counters': dict(self.counters),
+        'gauges': dict(self.gauges)
+      }
+
+  # append the metrics of the run as one JSON line
+  def writeJsonLines(self, path, labels = {}):
+    with open(path, 'a') as f:
+      f.write(json.dumps(self.toDict(labels), sort_keys = True) + '\n')
+
+  # write the metrics of the run for the Prometheus node exporter textfile collector, atomically
+  def writePrometheus(self, path, labels = {}):
+    data = self.toDict(labels)
+    labelText = ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in sorted(data['labels'].items()))
+
+    def series(name, extra = ''):
+      return '%s{%s}' % (name, ','.join(l for l in [labelText, extra] if l != ''))
+
+    lines = [
+      '# HELP deployer_run_timestamp_seconds Start time of the last deployer run',
+      '# TYPE deployer_run_timestamp_seconds gauge',
+      '%s %s' % (series('deployer_run_timestamp_seconds'), data['timestamp']),
+      '# HELP deployer_run_seconds Duration of the last deployer run',
+      '# TYPE deployer_run_seconds gauge',
+      '%s %s' % (series('deployer_run_seconds'), data['totalSeconds']),
+      '# HELP deployer_phase_seconds Duration of each phase of the last deployer run',
+      '# TYPE deployer_phase_seconds gauge'
+    ]
+    lines.extend('%s %s' % (series('deployer_phase_seconds', 'phase="%s"' % name), value) for name, value in sorted(data['phaseSeconds'].items()))
+    lines.extend(['# HELP deployer_events Counted events of the last deployer run, e.g. attempts and conflicts', '# TYPE deployer_events gauge'])
+    lines.extend('%s %s' % (series('deployer_events', 'event="%s"' % name), value) for name, value in sorted(data['counters'].items()))
+    lines.extend(['# HELP deployer_size Sizes seen by the last deployer run, e.g. payload bytes and processes', '# TYPE deployer_size gauge'])
+    lines.extend('%s %s' % (series('deployer_size', 'size="%s"' % name), value) for name, value in sorted(data['gauges'].items()))
+    with open(path + '.tmp', 'w') as f:
+      f.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp', path)
+
+# the metrics of the current run
+metrics = Metrics()
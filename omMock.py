@@ -0,0 +1,220 @@
+# /
+  # Local stand-in for the Ops Manager automation API, for testing and benchmarking without a real Ops Manager
+  #
+  # Serves `/groups/{PROJECT-ID}/automationConfig` (GET and PUT) and `/groups/{PROJECT-ID}/automationStatus` (GET)
+  # under `/api/public/v1.0`, with HTTP digest authentication and optional TLS. A PUT carrying a `version` that is
+  # not the current version is rejected with `409`, as Ops Manager does. Latency and errors can be injected.
+  #
+  # functions:
+  #   MockOpsManager: the mock server, with request, conflict and byte counters
+  #   initialConfig: create an empty automation config
+# /
+
+try:
+  import argparse
+  import gzip
+  import hashlib
+  import json
+  import os
+  import random
+  import re
+  import ssl
+  import threading
+  from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+  from time import sleep
+except ImportError as e:
+  print(e)
+  exit(1)
+
+REALM = 'MMS Public API'
+
+# /
+  # initialConfig function to create an empty automation config
+  #
+  # Inputs:
+  #   mongoDbVersions: number of synthetic `mongoDbVersions` entries, to give the config a realistic size, defaults to `0`
+# /
+def initialConfig(mongoDbVersions = 0):
+  return {
+    'version': 1,
+    'agentVersion': {'directoryUrl': 'http://localhost/download/agent/automation/', 'name': '10.14.24.6505-1'},
+    'processes': [],
+    'replicaSets': [],
+    'sharding': [],
+    'backupVersions': [],
+    'monitoringVersions': [],
+    'options': {'downloadBase': '/var/lib/mongodb-mms-automation'},
+    'mongoDbVersions': [{'name': '4.4.%s-ent' % i, 'builds': [{'platform': 'linux', 'architecture': 'amd64', 'flavor': 'rhel', 'url': 'https://downloads.mongodb.com/linux/mongodb-linux-x86_64-enterprise-rhel80-4.4.%s.tgz' % i}]} for i in range(mongoDbVersions)]
+  }
+
+def md5(value):
+  return hashlib.md5(value.encode()).hexdigest()
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  route = re.compile(r'^/api/public/v1\.0/groups/([^/]+)/(automationConfig|automationStatus)$')
+
+  def log_message(self, format, *args):
+    if self.server.mock.verbose:
+      BaseHTTPRequestHandler.log_message(self, format, *args)
+
+  def reply(self, status, body = None, headers = {}):
+    data = b'' if body == None else json.dumps(body).encode()
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(data)
+    self.server.mock.count('bytesSent', len(data))
+
+  # verify the digest `Authorization` header, qop `auth` only
+  def authorised(self):
+    header = self.headers.get('Authorization', '')
+    if not header.startswith('Digest '):
+      return False
+    fields = dict((key, value.strip('"')) for key, value in re.findall(r'(\w+)=("[^"]*"|[^,\s]*)', header[7:]))
+    mock = self.server.mock
+    if fields.get('username') != mock.publicKey or fields.get('nonce') not in mock.nonces:
+      return False
+    ha1 = md5('%s:%s:%s' % (mock.publicKey, REALM, mock.privateKey))
+    ha2 = md5('%s:%s' % (self.command, fields.get('uri', '')))
+    expected = md5('%s:%s:%s:%s:%s:%s' % (ha1, fields['nonce'], fields.get('nc', ''), fields.get('cnonce', ''), fields.get('qop', ''), ha2))
+    return fields.get('response') == expected
+
+  def handle_one(self):
+    mock = self.server.mock
+    length = int(self.headers.get('Content-Length', 0))
+    body = self.rfile.read(length) if length > 0 else b''
+    mock.count('requests')
+    mock.count('bytesReceived', length)
+
+    if mock.latency > 0:
+      sleep(random.uniform(mock.latency / 2, mock.latency * 1.5))
+
+    if not self.authorised():
+      nonce = os.urandom(16).hex()
+      mock.nonces.add(nonce)
+      mock.count('challenges')
+      self.reply(401, {'error': 401, 'reason': 'Unauthorized'}, {'WWW-Authenticate': 'Digest realm="%s", qop="auth", nonce="%s", algorithm=MD5' % (REALM, nonce)})
+      return
+
+    if random.random() < mock.errorRate:
+      mock.count('errors')
+      self.reply(503, {'error': 503, 'reason': 'Injected error'})
+      return
+
+    match = self.route.match(self.path)
+    if match == None or match.group(1) != mock.projectID:
+      self.reply(404, {'error': 404, 'reason': 'Not Found'})
+      return
+
+    if match.group(2) == 'automationStatus' and self.command == 'GET':
+      with mock.lock:
+        version = mock.config['version']
+        self.reply(200, {'goalVersion': version, 'processes': [{'hostname': p['hostname'], 'name': p['name'], 'lastGoalVersionAchieved': version, 'plan': []} for p in mock.config['processes']]})
+    elif match.group(2) == 'automationConfig' and self.command == 'GET':
+      with mock.lock:
+        self.reply(200, mock.config)
+    elif match.group(2) == 'automationConfig' and self.command == 'PUT':
+      if self.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+      config = json.loads(body)
+      with mock.lock:
+        if 'version' in config and config['version'] != mock.config['version']:
+          mock.count('conflicts')
+          self.reply(409, {'error': 409, 'errorCode': 'CONFLICTING_AUTOMATION_CONFIG_UPDATE', 'reason': 'Conflict'})
+          return
+        config['version'] = mock.config['version'] + 1
+        config.setdefault('mongoDbVersions', mock.config['mongoDbVersions'])
+        mock.config = config
+        mock.count('updates')
+        self.reply(200, {})
+    else:
+      self.reply(405, {'error': 405, 'reason': 'Method Not Allowed'})
+
+  def do_GET(self):
+    self.handle_one()
+
+  def do_PUT(self):
+    self.handle_one()
+
+# /
+  # MockOpsManager class, the mock server. `start` serves in a background thread, `stats` returns the counters.
+  #
+  # Inputs:
+  #   projectID: the project identifier served
+  #   publicKey: the public key portion of the API Access Key accepted
+  #   privateKey: the private key portion of the API Access Key accepted
+  #   host: address to listen on, defaults to `127.0.0.1`
+  #   port: port to listen on, defaults to `0` for any free port
+  #   certificate: path to a combined PEM certificate and key to serve TLS. OPTIONAL
+  #   latency: mean injected latency of every request in seconds, defaults to `0`
+  #   errorRate: fraction of authenticated requests answered with `503`, defaults to `0`
+  #   config: the initial automation config, defaults to `initialConfig()`. OPTIONAL
+  #   verbose: Boolean to log every request, default is `False`
+# /
+class MockOpsManager:
+  def __init__(self, projectID, publicKey, privateKey, host = '127.0.0.1', port = 0, certificate = None, latency = 0, errorRate = 0, config = None, verbose = False):
+    self.projectID = projectID
+    self.publicKey = publicKey
+    self.privateKey = privateKey
+    self.latency = latency
+    self.errorRate = errorRate
+    self.config = config or initialConfig()
+    self.verbose = verbose
+    self.nonces = set()
+    self.lock = threading.RLock()
+    self.counters = {'requests': 0, 'challenges': 0, 'conflicts': 0, 'errors': 0, 'updates': 0, 'bytesSent': 0, 'bytesReceived': 0}
+    self.server = ThreadingHTTPServer((host, port), Handler)
+    self.server.daemon_threads = True
+    self.server.mock = self
+    self.scheme = 'http'
+    if certificate != None:
+      context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+      context.load_cert_chain(certificate)
+      self.server.socket = context.wrap_socket(self.server.socket, server_side = True)
+      self.scheme = 'https'
+
+  @property
+  def baseurl(self):
+    return '%s://%s:%s/api/public/v1.0' % (self.scheme, self.server.server_address[0], self.server.server_address[1])
+
+  def count(self, counter, value = 1):
+    with self.lock:
+      self.counters[counter] += value
+
+  def stats(self):
+    with self.lock:
+      return dict(self.counters)
+
+  def start(self):
+    thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+    thread.start()
+    return thread
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Local stand-in for the Ops Manager automation API')
+  parser.add_argument('--port', type = int, default = 8443, help = 'port to listen on, defaults to `8443`')
+  parser.add_argument('--host', default = '127.0.0.1', help = 'address to listen on, defaults to `127.0.0.1`')
+  parser.add_argument('--project-id', dest = 'projectID', default = '5f87840518322b1e72bdff8d', help = 'project identifier served')
+  parser.add_argument('--public-key', dest = 'publicKey', default = 'PUBLIC', help = 'public key of the API Access Key accepted')
+  parser.add_argument('--private-key', dest = 'privateKey', default = 'PRIVATE', help = 'private key of the API Access Key accepted')
+  parser.add_argument('--certificate', help = 'combined PEM certificate and key to serve TLS')
+  parser.add_argument('--latency', type = float, default = 0, help = 'mean injected latency of every request in seconds')
+  parser.add_argument('--error-rate', dest = 'errorRate', type = float, default = 0, help = 'fraction of requests answered with `503`')
+  args = parser.parse_args()
+
+  mock = MockOpsManager(projectID = args.projectID, publicKey = args.publicKey, privateKey = args.privateKey, host = args.host, port = args.port, certificate = args.certificate, latency = args.latency, errorRate = args.errorRate, verbose = True)
+  print("Serving %s/groups/%s/automationConfig" % (mock.baseurl, args.projectID))
+  try:
+    mock.server.serve_forever()
+  except KeyboardInterrupt:
+    print(json.dumps(mock.stats(), indent = 2))
+
+if __name__ == "__main__": main()
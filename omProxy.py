@@ -0,0 +1,178 @@
+# /
+  # Node-local proxy that coalesces the registrations of the deployers on a node
+  #
+  # Listens on a Unix socket for member intents, the host configs built by `deployer.py` one JSON document per line. The
+  # intents of the same Ops Manager project that arrive within the batching window are applied to one fetched automation
+  # config and sent in one PUT, and every caller is told the result. While a batch is in flight the next intents queue for
+  # the following batch, so the number of requests to Ops Manager grows with the number of batches rather than of pods.
+  # If an intent of a batch is rejected while it is applied, e.g. an invalid topology, the intents are retried one at a time so a
+  # bad intent does not fail the others. Failures of Ops Manager, e.g. timeouts, errors or conflicts left after every attempt, are
+  # sent to every caller of the batch, so a struggling Ops Manager is not sent one more update per intent.
+  #
+  # functions:
+  #   IntentError: an intent was rejected while it was applied to the fetched config
+  #   Coalescer: batches the intents of one Ops Manager project into one read-modify-write
+  #   CoalescingProxy: the Unix socket server, with a `Coalescer` per project
+# /
+
+try:
+  import argparse
+  import deployer
+  import json
+  import os
+  import socketserver
+  import threading
+  from time import sleep
+except ImportError as e:
+  print(e)
+  exit(1)
+
+# an intent of the batch was rejected while it was applied to the fetched config, rather than Ops Manager failing
+class IntentError(Exception):
+  pass
+
+# /
+  # Coalescer class, batches the intents of one Ops Manager project. The first intent of a batch starts a worker that waits
+  #   for the batching window, then applies every pending intent in one update.
+  #
+  # Inputs:
+  #   window: seconds to wait for more intents before a batch is sent, defaults to `0.2`
+# /
+class Coalescer:
+  def __init__(self, window = 0.2):
+    self.window = window
+    self.lock = threading.Lock()
+    self.pending = []
+    self.running = False
+    self.batches = 0
+
+  # queue an intent and wait for the result of its batch
+  def submit(self, hostConfigs, aaVersion):
+    intent = {'hostConfigs': hostConfigs, 'aaVersion': aaVersion, 'done': threading.Event(), 'result': None}
+    with self.lock:
+      self.pending.append(intent)
+      if self.running == False:
+        self.running = True
+        threading.Thread(target = self.run, daemon = True).start()
+    intent['done'].wait()
+    return intent['result']
+
+  def run(self):
+    while True:
+      sleep(self.window)
+      with self.lock:
+        batch = self.pending
+        self.pending = []
+        if len(batch) == 0:
+          self.running = False
+          return
+      self.apply(batch)
+
+  # apply a batch, one intent at a time if an intent was rejected
+  def apply(self, batch):
+    try:
+      result = self.update(batch)
+    except Exception as e:
+      if isinstance(e, IntentError) and len(batch) > 1:
+        print("Batch of %s failed, retrying one at a time: %s" % (len(batch), repr(e)))
+        for intent in batch:
+          self.apply([intent])
+        return
+      result = {'ok': False, 'error': repr(e)}
+    for intent in batch:
+      intent['result'] = result
+      intent['done'].set()
+
+  # one read-modify-write of the project with the members of every intent of the batch
+  def update(self, batch):
+    hostConfigs = [hostConfig for intent in batch for hostConfig in intent['hostConfigs']]
+    iConfig = hostConfigs[0]
+    mutate = deployer.memberMutation(hostConfigs, aaVersion = batch[0]['aaVersion'])
+
+    # exceptions of the mutation are caused by the intents, the others by Ops Manager
+    def apply(currentConfig):
+      try:
+        return mutate(currentConfig)
+      except Exception as e:
+        raise IntentError(repr(e)) from e
+
+    reply, requiredConfig, attempts = deployer.omClientFor(iConfig).update(endpoint = '/groups/' + iConfig['projectID'] + '/automationConfig', mutate = apply,
+      attempts = iConfig.get('retryAttempts', 5), deadline = iConfig.get('retryDeadlineSecs'), skip = ['mongoDbVersions'], priority = deployer.requestPriority(hostConfigs))
+    if reply != None:
+      deployer.snapshot(hostConfigs = hostConfigs, requiredConfig = requiredConfig)
+    with self.lock:
+      self.batches += 1
+    print("Batch of %s registration(s) for project %s: %s change(s), %s attempt(s)" % (len(batch), iConfig['projectID'], len(mutate.changes), attempts))
+    return {'ok': True, 'changes': len(mutate.changes), 'attempts': attempts, 'batch': len(batch)}
+
+# every pod of a node may connect at once
+class Server(socketserver.ThreadingUnixStreamServer):
+  request_queue_size = 256
+  daemon_threads = True
+
+class Handler(socketserver.StreamRequestHandler):
+  def handle(self):
+    line = self.rfile.readline()
+    if line == b'':
+      return
+    try:
+      intent = json.loads(line)
+      result = self.server.proxy.coalescer(intent['hostConfigs'][0]).submit(hostConfigs = intent['hostConfigs'], aaVersion = intent.get('aaVersion'))
+    except Exception as e:
+      result = {'ok': False, 'error': repr(e)}
+    self.wfile.write(json.dumps(result).encode() + b'\n')
+
+# /
+  # CoalescingProxy class, the Unix socket server. Intents are batched per Ops Manager project and API key, so only intents
+  #   that could have been sent together are merged.
+  #
+  # Inputs:
+  #   path: path of the Unix socket, replaced if it exists
+  #   window: seconds to wait for more intents before a batch is sent, defaults to `0.2`
+  #   mode: permissions of the socket, defaults to `0o660`
+# /
+class CoalescingProxy:
+  def __init__(self, path, window = 0.2, mode = 0o660):
+    self.path = path
+    self.window = window
+    self.lock = threading.Lock()
+    self.coalescers = {}
+    if os.path.exists(path):
+      os.remove(path)
+    self.server = Server(path, Handler)
+    self.server.proxy = self
+    os.chmod(path, mode)
+
+  # the `Coalescer` of the project of a host config, created if absent
+  def coalescer(self, iConfig):
+    key = (iConfig['omBaseURL'], iConfig['projectID'], iConfig['publicKey'], iConfig['privateKey'], iConfig['ca_cert_path'])
+    with self.lock:
+      if key not in self.coalescers:
+        self.coalescers[key] = Coalescer(window = self.window)
+      return self.coalescers[key]
+
+  def start(self):
+    thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+    thread.start()
+    return thread
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Node-local proxy that coalesces the registrations of the deployers on a node')
+  parser.add_argument('--socket', default = '/var/run/deployer/proxy.sock', help = 'path of the Unix socket, set as `proxySocket` in `config.json`, defaults to `/var/run/deployer/proxy.sock`')
+  parser.add_argument('--window', type = float, default = 0.2, help = 'seconds to wait for more registrations before a batch is sent, defaults to `0.2`')
+  args = parser.parse_args()
+
+  proxy = CoalescingProxy(args.socket, window = args.window)
+  print("Listening on %s" % args.socket)
+  try:
+    proxy.server.serve_forever()
+  except KeyboardInterrupt:
+    proxy.stop()
+
+if __name__ == "__main__": main()
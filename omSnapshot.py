@@ -0,0 +1,260 @@
+# /
+  # Functions to keep an audit trail of the automation configs sent to Ops Manager as one compressed baseline
+  #   plus compact JSON-Patch style deltas, one per run
+  #
+  # functions:
+  #   diff: create the JSON-Patch style operations to turn one document into another
+  #   patch: apply JSON-Patch style operations to a document
+  #   history: list the baseline and deltas in a snapshot directory
+  #   reconstruct: rebuild the automation config as it was at a snapshot
+  #   save: record an automation config as a delta against the latest snapshot, folding old deltas into the baseline
+  #   saveAsync: `save` in a background thread, off the critical path
+# /
+
+try:
+  import argparse
+  import copy
+  import fcntl
+  import gzip
+  import json
+  import omMetrics
+  import os
+  import threading
+  from datetime import datetime
+except ImportError as e:
+  print(e)
+  exit(1)
+
+BASELINE = 'baseline.json.gz'
+DELTA_SUFFIX = '.delta.json.gz'
+# the latest config in full, uncompressed, so a save diffs against it without replaying the deltas
+HEAD_SUFFIX = '.head.json'
+
+# escape a key for use in a JSON Pointer
+def pointer(path, key):
+  return path + '/' + str(key).replace('~', '~0').replace('/', '~1')
+
+# equality that also compares the types, as `1 == 1.0 == True` in Python but not in the document sent to Ops Manager. The
+#   C level `==` rules out most differences first, only equal containers are walked
+def equal(old, new):
+  if old != new or type(old) is not type(new):
+    return False
+  if type(old) is dict:
+    pairs = ((value, new[key]) for key, value in old.items())
+  elif type(old) is list:
+    pairs = zip(old, new)
+  else:
+    return True
+  for a, b in pairs:
+    if type(a) is not type(b):
+      return False
+    if (type(a) is dict or type(a) is list) and equal(a, b) == False:
+      return False
+  return True
+
+# /
+  # diff function to create the JSON-Patch style operations (`add`, `remove`, `replace`) to turn `old` into `new`.
+  #   Lists are compared after trimming their common prefix and suffix, so a single member added or removed
+  #   is one operation rather than a rewrite of the list.
+  #
+  # Inputs:
+  #   old: the original document
+  #   new: the desired document
+  #   path: JSON Pointer of the documents, used when recursing. OPTIONAL
+# /
+def diff(old, new, path = ''):
+  if equal(old, new):
+    return []
+  if isinstance(old, dict) and isinstance(new, dict):
+    ops = []
+    for key in old:
+      if key not in new:
+        ops.append({'op': 'remove', 'path': pointer(path, key)})
+    for key in new:
+      if key not in old:
+        ops.append({'op': 'add', 'path': pointer(path, key), 'value': new[key]})
+      else:
+        ops.extend(diff(old[key], new[key], pointer(path, key)))
+    return ops
+  if isinstance(old, list) and isinstance(new, list):
+    start = 0
+    while start < len(old) and start < len(new) and equal(old[start], new[start]):
+      start += 1
+    oldEnd = len(old)
+    newEnd = len(new)
+    while oldEnd > start and newEnd > start and equal(old[oldEnd - 1], new[newEnd - 1]):
+      oldEnd -= 1
+      newEnd -= 1
+    ops = []
+    # elements changed in place
+    common = min(oldEnd, newEnd) - start
+    for i in range(start, start + common):
+      ops.extend(diff(old[i], new[i], pointer(path, i)))
+    # removed elements, from the end so the indexes stay valid
+    for i in reversed(range(start + common, oldEnd)):
+      ops.append({'op': 'remove', 'path': pointer(path, i)})
+    # added elements
+    for i in range(start + common, newEnd):
+      ops.append({'op': 'add', 'path': pointer(path, i), 'value': new[i]})
+    return ops
+  return [{'op': 'replace', 'path': path, 'value': new}]
+
+# /
+  # patch function to apply JSON-Patch style operations to a document. The document is modified in place.
+  #
+  # Inputs:
+  #   document: the document to modify
+  #   ops: list of operations as created by `diff`
+# /
+def patch(document, ops):
+  for op in ops:
+    if op['path'] == '':
+      document = op['value']
+      continue
+    keys = [key.replace('~1', '/').replace('~0', '~') for key in op['path'].split('/')[1:]]
+    parent = document
+    for key in keys[:-1]:
+      parent = parent[int(key)] if isinstance(parent, list) else parent[key]
+    key = int(keys[-1]) if isinstance(parent, list) else keys[-1]
+    if op['op'] == 'remove':
+      parent.pop(key)
+    elif op['op'] == 'add' and isinstance(parent, list):
+      parent.insert(key, op['value'])
+    else:
+      parent[key] = op['value']
+  return document
+
+def readJson(path):
+  with gzip.open(path, 'rt') as f:
+    return json.load(f)
+
+# write atomically, so a reader never sees a partial file
+def writeJson(path, data):
+  with gzip.open(path + '.tmp', 'wt', compresslevel = 6) as f:
+    # `dumps` uses the C encoder, `dump` encodes in Python one chunk at a time
+    f.write(json.dumps(data, separators = (',', ':')))
+  os.replace(path + '.tmp', path)
+
+# write the latest config as `<snapshot>.head.json` and remove the previous head. The file is always new, as renaming
+#   over an existing file makes the filesystem flush it first
+def writeHead(directory, snapshot, config):
+  path = os.path.join(directory, snapshot + HEAD_SUFFIX)
+  with open(path + '.tmp', 'w') as f:
+    f.write(json.dumps(config, separators = (',', ':')))
+  os.replace(path + '.tmp', path)
+  for f in os.listdir(directory):
+    if f.endswith(HEAD_SUFFIX) and f != snapshot + HEAD_SUFFIX:
+      os.remove(os.path.join(directory, f))
+
+# the latest config, from its head if present, else rebuilt from the deltas
+def latest(directory, snapshots):
+  try:
+    with open(os.path.join(directory, snapshots[-1] + HEAD_SUFFIX), 'r') as f:
+      return json.loads(f.read())
+  except (OSError, ValueError):
+    return reconstruct(directory)
+
+# /
+  # history function to list the snapshots in a directory, oldest first. The first entry is the baseline.
+  #
+  # Inputs:
+  #   directory: the snapshot directory
+# /
+def history(directory):
+  if not os.path.isfile(os.path.join(directory, BASELINE)):
+    return []
+  snapshots = ['baseline']
+  snapshots.extend(sorted(f[:-len(DELTA_SUFFIX)] for f in os.listdir(directory) if f.endswith(DELTA_SUFFIX)))
+  return snapshots
+
+# /
+  # reconstruct function to rebuild the automation config as it was at a snapshot
+  #
+  # Inputs:
+  #   directory: the snapshot directory
+  #   snapshot: the snapshot identifier as listed by `history`, defaults to the latest. OPTIONAL
+# /
+def reconstruct(directory, snapshot = None):
+  snapshots = history(directory)
+  if len(snapshots) == 0:
+    raise Exception("No snapshots in %s" % directory)
+  if snapshot == None:
+    snapshot = snapshots[-1]
+  if snapshot not in snapshots:
+    raise Exception("Snapshot %s not found in %s" % (snapshot, directory))
+  config = readJson(os.path.join(directory, BASELINE))['config']
+  for delta in snapshots[1:snapshots.index(snapshot) + 1]:
+    config = patch(config, readJson(os.path.join(directory, delta + DELTA_SUFFIX))['patch'])
+  return config
+
+# /
+  # save function to record an automation config as a delta against the latest snapshot. The first save
+  #   creates the baseline. The latest config is also kept in full as `<snapshot>.head.json`, so the delta is
+  #   taken without replaying the others. When there are more than `retention` deltas the oldest are folded
+  #   into the baseline, down to nine tenths of `retention`.
+  #
+  # Inputs:
+  #   directory: the snapshot directory, created if absent
+  #   name: name recorded with the snapshot, e.g. the short hostname
+  #   config: the automation config
+  #   retention: maximum number of deltas to keep, defaults to `50`
+# /
+def save(directory, name, config, retention = 50):
+  with omMetrics.metrics.phase('snapshot'):
+    os.makedirs(directory, exist_ok = True)
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      snapshots = history(directory)
+      if len(snapshots) == 0:
+        writeJson(os.path.join(directory, BASELINE), {'timestamp': timestamp, 'name': name, 'config': config})
+        writeHead(directory, 'baseline', config)
+        return 'baseline'
+
+      ops = diff(latest(directory, snapshots), config)
+      snapshot = timestamp + '-' + name
+      writeJson(os.path.join(directory, snapshot + DELTA_SUFFIX), {'timestamp': timestamp, 'name': name, 'patch': ops})
+      writeHead(directory, snapshot, config)
+
+      # fold the oldest deltas into the baseline, a tenth of `retention` more than needed so the baseline is not rewritten every save
+      deltas = snapshots[1:] + [snapshot]
+      if len(deltas) > retention:
+        expired = deltas[:len(deltas) - retention + retention // 10]
+        baseline = readJson(os.path.join(directory, BASELINE))
+        for delta in expired:
+          baseline['config'] = patch(baseline['config'], readJson(os.path.join(directory, delta + DELTA_SUFFIX))['patch'])
+          baseline['timestamp'], baseline['name'] = delta.split('-', 1)
+        writeJson(os.path.join(directory, BASELINE), baseline)
+        for delta in expired:
+          os.remove(os.path.join(directory, delta + DELTA_SUFFIX))
+      return snapshot
+
+# /
+  # saveAsync function to `save` in a background thread. The thread is not a daemon, so the snapshot is
+  #   completed before the interpreter exits. Returns the thread.
+  #
+  # Inputs:
+  #   directory: the snapshot directory, created if absent
+  #   name: name recorded with the snapshot, e.g. the short hostname
+  #   config: the automation config, copied before returning so the caller may modify it
+  #   retention: maximum number of deltas to keep, defaults to `50`
+# /
+def saveAsync(directory, name, config, retention = 50):
+  thread = threading.Thread(target = save, kwargs = {'directory': directory, 'name': name, 'config': copy.deepcopy(config), 'retention': retention})
+  thread.start()
+  return thread
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Inspect the automation config snapshots of the deployer')
+  parser.add_argument('directory', help = 'the snapshot directory')
+  parser.add_argument('snapshot', nargs = '?', help = 'snapshot to reconstruct, defaults to the latest')
+  parser.add_argument('--list', action = 'store_true', help = 'list the snapshots instead')
+  args = parser.parse_args()
+
+  if args.list:
+    for snapshot in history(args.directory):
+      print(snapshot)
+  else:
+    print(json.dumps(reconstruct(args.directory, args.snapshot), indent = 2, sort_keys = True))
+
+if __name__ == "__main__": main()
@@ -0,0 +1,32 @@
+# /
+  # Settings and documents shared by the tests
+  #
+  # functions:
+  #   BASE_CONFIG: `config.json` of a replica set `rs0` with a placeholder Ops Manager, override `omBaseURL` to use `omMock`
+  #   emptyConfig: automation config of a project without any process
+# /
+
+BASE_CONFIG = {
+  'omBaseURL': 'http://localhost:8080/api/public/v1.0',
+  'projectID': '5f87840518322b1e72bdff8d',
+  'publicKey': 'PUBLIC',
+  'privateKey': 'PRIVATE',
+  'subDomain': 'test',
+  'dnsSuffix': 'mongodb.local',
+  'ca_cert_path': '/dev/null',
+  'port': 27017,
+  'replicaSetName': 'rs0',
+  'mongoDBVersion': '4.4.5-ent'
+}
+
+def emptyConfig():
+  return {
+    'version': 1,
+    'agentVersion': {'directoryUrl': 'http://localhost/download/agent/automation/', 'name': '10.14.24.6505-1'},
+    'processes': [],
+    'replicaSets': [],
+    'sharding': [],
+    'backupVersions': [],
+    'monitoringVersions': [],
+    'options': {'downloadBase': '/var/lib/mongodb-mms-automation'}
+  }
@@ -0,0 +1,31 @@
+import asyncio
+import deployer
+import fleet
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from helpers import BASE_CONFIG
+
+class TestFleet(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_project_without_hosts_fails(self):
+    configPath = os.path.join(self.directory, 'project.json')
+    with open(configPath, 'w') as f:
+      json.dump(BASE_CONFIG, f)
+    with self.assertRaisesRegex(Exception, 'No hosts'):
+      asyncio.run(fleet.reconcile(configPath, executor = None, hostConnections = 1))
+
+  def test_snapshot_directory_per_project(self):
+    other = dict(BASE_CONFIG, projectID = '5f87840518322b1e72bdff8e')
+    self.assertNotEqual(deployer.snapshotDir(BASE_CONFIG), deployer.snapshotDir(other))
+    self.assertEqual(deployer.snapshotDir(dict(BASE_CONFIG, snapshotDir = '/var/lib/deployer')), '/var/lib/deployer/5f87840518322b1e72bdff8d')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,33 @@
+import omCommon
+import unittest
+
+# a client answering every GET with the same automation status
+class StatusClient(omCommon.Client):
+  def __init__(self, processes):
+    omCommon.Client.__init__(self, baseurl = 'http://localhost:8080/api/public/v1.0', ca_cert_path = '/dev/null', privateKey = 'PRIVATE', publicKey = 'PUBLIC')
+    self.status = {'goalVersion': 5, 'processes': processes}
+
+  def get(self, endpoint, skip = None, metered = True, priority = omCommon.PRIORITY_DEFAULT):
+    return self.status
+
+class TestWaitForGoalState(unittest.TestCase):
+  PROCESSES = [
+    {'hostname': 'mongod-0-0.mongodb.local', 'lastGoalVersionAchieved': 5},
+    {'hostname': 'other-0-0.mongodb.local', 'lastGoalVersionAchieved': 3}
+  ]
+
+  # a process of another replica set that is behind does not hold up the registered hosts
+  def test_only_the_given_hosts(self):
+    latencies = StatusClient(self.PROCESSES).waitForGoalState('/groups/p/automationStatus', deadline = 1, hostnames = ['mongod-0-0.mongodb.local'])
+    self.assertEqual(list(latencies), ['mongod-0-0.mongodb.local'])
+
+  def test_whole_project(self):
+    with self.assertRaises(TimeoutError):
+      StatusClient(self.PROCESSES).waitForGoalState('/groups/p/automationStatus', deadline = 0.2, minInterval = 0.05)
+
+  def test_host_not_reported_yet(self):
+    with self.assertRaisesRegex(TimeoutError, 'mongod-0-1'):
+      StatusClient(self.PROCESSES).waitForGoalState('/groups/p/automationStatus', deadline = 0.2, minInterval = 0.05, hostnames = ['mongod-0-0.mongodb.local', 'mongod-0-1.mongodb.local'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,57 @@
+import json
+import omCommon
+import unittest
+
+# strings with escapes, brackets and non-ASCII text, in kept and skipped sections, with scalars skipped last
+DOCUMENT = json.dumps({
+  'version': 12,
+  'processes': [{'name': 'rs0_mongod-0', 'args2_6': {'net': {'port': 27017}}, 'tags': ['a"b', 'c\\\\', '{[', ']}']}],
+  'mongoDbVersions': [{'name': '4.4.5-ent', 'builds': [{'url': 'https://example.com/"quoted"/\\\\path\\\\', 'flags': ['}', ']']}]}],
+  'naïve-ключ-鍵': {'wert': 'größe ✓', 'escaped': 'é\\n\\t\\u00e9'},
+  'options': {'downloadBase': '/var/lib/mongodb-mms-automation'},
+  'quoted "key" \\': ['\u2028', '\x01'],
+  'enabled': True,
+  'empty': {},
+  'nothing': None,
+  'skippedNumber': 12345678,
+  'skippedTrue': True
+}, ensure_ascii = False, indent = 1).encode('utf-8')
+
+SKIP = ['mongoDbVersions', 'naïve-ключ-鍵', 'skippedNumber', 'skippedTrue']
+
+def chunked(data, size):
+  return [data[i:i + size] for i in range(0, len(data), size)]
+
+class TestConfigStreamParser(unittest.TestCase):
+  # every chunk size from one byte splits strings, escapes, multi-byte characters and scalars at every position
+  def test_every_chunk_boundary(self):
+    expected = json.loads(DOCUMENT)
+    for size in range(1, 8):
+      with self.subTest(size = size):
+        self.assertEqual(omCommon.ConfigStreamParser(chunked(DOCUMENT, size)).parse(), expected)
+
+  def test_skipped_sections(self):
+    expected = dict((k, v) for k, v in json.loads(DOCUMENT).items() if k not in SKIP)
+    for size in [1, 2, 3, 5, 7, len(DOCUMENT)]:
+      with self.subTest(size = size):
+        self.assertEqual(omCommon.ConfigStreamParser(chunked(DOCUMENT, size), skip = SKIP).parse(), expected)
+
+  # the last section is a scalar that is skipped, ending exactly at the end of a chunk
+  def test_skipped_scalar_at_the_end_of_the_buffer(self):
+    document = b'{"version":1,"skipped":12345}'
+    expected = {'version': 1}
+    for split in range(1, len(document)):
+      with self.subTest(split = split):
+        self.assertEqual(omCommon.ConfigStreamParser([document[:split], document[split:]], skip = ['skipped']).parse(), expected)
+
+  def test_empty_chunks_and_document(self):
+    self.assertEqual(omCommon.ConfigStreamParser([b'', b' {', b'', b' } ']).parse(), {})
+
+  def test_truncated_document(self):
+    for document in [b'{"version":1', b'{"version":"1', b'{"skipped":[1,{"a":"]"', b'{"skipped":"\\']:
+      with self.subTest(document = document):
+        with self.assertRaises(ValueError):
+          omCommon.ConfigStreamParser(chunked(document, 3), skip = ['skipped']).parse()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,45 @@
+import deployer
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from helpers import BASE_CONFIG
+
+HOSTS = ['mongod-0-0.mongod-0-svc.mongodb.svc.cluster.local']
+
+class TestPlanCache(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.iConfig = dict(BASE_CONFIG, planCacheDir = os.path.join(self.directory, 'plans'))
+    self.configBytes = json.dumps(self.iConfig).encode()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def plans(self):
+    planDir = self.iConfig['planCacheDir']
+    return [os.path.join(planDir, p) for p in os.listdir(planDir) if p.endswith('.plan.json')]
+
+  def test_plan_is_private_and_without_credentials(self):
+    deployer.compilePlan(configBytes = self.configBytes, iConfig = self.iConfig, hosts = HOSTS)
+    plans = self.plans()
+    self.assertEqual(len(plans), 1)
+    self.assertEqual(stat.S_IMODE(os.stat(plans[0]).st_mode), 0o600)
+    with open(plans[0], 'r') as f:
+      cached = f.read()
+    self.assertNotIn('PUBLIC', cached)
+    self.assertNotIn('PRIVATE', cached)
+
+  def test_credentials_come_from_the_live_config(self):
+    deployer.compilePlan(configBytes = self.configBytes, iConfig = self.iConfig, hosts = HOSTS)
+    written = os.stat(self.plans()[0]).st_mtime_ns
+    rotated = dict(self.iConfig, publicKey = 'ROTATED', privateKey = 'ROTATED')
+    hostConfigs, aaVersion = deployer.compilePlan(configBytes = self.configBytes, iConfig = rotated, hosts = HOSTS)
+    self.assertEqual(os.stat(self.plans()[0]).st_mtime_ns, written)
+    self.assertEqual((hostConfigs[0]['publicKey'], hostConfigs[0]['privateKey']), ('ROTATED', 'ROTATED'))
+    self.assertEqual(hostConfigs[0]['fqdn'], HOSTS[0])
+
+if __name__ == '__main__':
+  unittest.main()
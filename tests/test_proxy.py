@@ -0,0 +1,55 @@
+import copy
+import deployer
+import omMock
+import omProxy
+import shutil
+import tempfile
+import threading
+import unittest
+from helpers import BASE_CONFIG
+
+class TestCoalescer(unittest.TestCase):
+  def setUp(self):
+    self.mock = None
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    if self.mock != None:
+      self.mock.stop()
+    shutil.rmtree(self.directory)
+
+  def start(self, errorRate = 0):
+    self.mock = omMock.MockOpsManager(projectID = BASE_CONFIG['projectID'], publicKey = BASE_CONFIG['publicKey'], privateKey = BASE_CONFIG['privateKey'], errorRate = errorRate)
+    self.mock.start()
+    iConfig = dict(BASE_CONFIG, omBaseURL = self.mock.baseurl, retryAttempts = 1, snapshotDir = self.directory)
+    return [deployer.buildMembers(iConfig = copy.deepcopy(iConfig), hosts = ['mongod-%s.mongodb.local' % i]) for i in range(3)]
+
+  # submit every intent at once, so they are sent in one batch
+  def submit(self, intents):
+    coalescer = omProxy.Coalescer(window = 0.2)
+    results = [None] * len(intents)
+    def run(i):
+      results[i] = coalescer.submit(hostConfigs = intents[i], aaVersion = '10.14.24.6505-1')
+    threads = [threading.Thread(target = run, args = (i,)) for i in range(len(intents))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return coalescer, results
+
+  def test_rejected_intent_does_not_fail_the_others(self):
+    intents = self.start()
+    intents[1][0]['deploymentType'] = 'invalid'
+    coalescer, results = self.submit(intents)
+    self.assertEqual([result['ok'] for result in results], [True, False, True])
+    self.assertEqual(sorted(p['hostname'] for p in self.mock.config['processes']), ['mongod-0.mongodb.local', 'mongod-2.mongodb.local'])
+
+  # one failed GET is reported to every caller, the batch is not split into one update per intent
+  def test_ops_manager_failure_is_sent_to_every_caller(self):
+    intents = self.start(errorRate = 1)
+    coalescer, results = self.submit(intents)
+    self.assertEqual([result['ok'] for result in results], [False, False, False])
+    self.assertEqual(self.mock.stats()['errors'], 1)
+
+if __name__ == '__main__':
+  unittest.main()
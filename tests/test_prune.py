@@ -0,0 +1,74 @@
+import copy
+import deployer
+import omCommon
+import unittest
+from helpers import BASE_CONFIG, emptyConfig
+
+TOPOLOGY = {
+  'shardedClusterName': 'sc',
+  'configServer': {'replicaSetName': 'cs0', 'port': 27019, 'fqdnTemplate': 'cs0-{ordinal}.mongodb.local', 'ordinals': '0-2'},
+  'shards': [{'replicaSetName': 'sh0', 'fqdnTemplate': 'sh0-{ordinal}.mongodb.local', 'ordinals': '0-1'}],
+  'mongos': {'port': 27017, 'fqdnTemplate': 'ms-{ordinal}.mongodb.local', 'ordinals': '0-1'}
+}
+
+def replicaSetConfig(count):
+  hostConfigs = deployer.buildMembers(iConfig = copy.deepcopy(BASE_CONFIG), hosts = ['mongod-%s.mongodb.local' % i for i in range(count)])
+  return deployer.memberMutation(hostConfigs)(emptyConfig())
+
+def shardedConfig():
+  hostConfigs = deployer.buildTopology(dict(copy.deepcopy(BASE_CONFIG), topology = copy.deepcopy(TOPOLOGY)))
+  return deployer.memberMutation(hostConfigs)(emptyConfig())
+
+def hostnames(config):
+  return {
+    'processes': sorted(p['hostname'] for p in config['processes']),
+    'members': sorted(m['host'] for r in config['replicaSets'] for m in r['members']),
+    'backup': sorted(a['hostname'] for a in config['backupVersions']),
+    'monitoring': sorted(a['hostname'] for a in config['monitoringVersions'])
+  }
+
+class TestPruneMembers(unittest.TestCase):
+  # nothing is removed when a check fails
+  def assertRefused(self, config, message, **kwargs):
+    before = copy.deepcopy(config)
+    with self.assertRaisesRegex(Exception, message):
+      omCommon.pruneMembers(config, **kwargs)
+    self.assertEqual(config, before)
+
+  def test_scale_down_removes_only_the_stale_hosts(self):
+    config = replicaSetConfig(5)
+    live = ['mongod-%s.mongodb.local' % i for i in range(3)]
+    pruned = omCommon.pruneMembers(copy.deepcopy(config), liveHosts = live, replicaSetNames = ['rs0'])
+    names = dict((p['hostname'], p['name']) for p in config['processes'])
+    self.assertEqual(hostnames(pruned), {
+      'processes': live,
+      'members': sorted(names[h] for h in live),
+      'backup': live,
+      'monitoring': live
+    })
+    # the remaining entries are unchanged
+    self.assertEqual(pruned['processes'], [p for p in config['processes'] if p['hostname'] in live])
+    self.assertEqual(pruned['replicaSets'][0]['members'], [m for m in config['replicaSets'][0]['members'] if m['host'] in [names[h] for h in live]])
+
+  def test_losing_the_voting_majority(self):
+    self.assertRefused(replicaSetConfig(5), 'voting majority', liveHosts = ['mongod-0.mongodb.local', 'mongod-1.mongodb.local'], replicaSetNames = ['rs0'])
+
+  def test_removing_every_member_of_a_shard(self):
+    config = shardedConfig()
+    live = [p['hostname'] for p in config['processes'] if not p['hostname'].startswith('sh0-')]
+    self.assertRefused(config, 'every member of sh0, which is part of the sc sharded cluster', liveHosts = live, replicaSetNames = ['cs0', 'sh0'], shardedClusterNames = ['sc'])
+
+  def test_removing_every_mongos(self):
+    config = shardedConfig()
+    live = [p['hostname'] for p in config['processes'] if p['processType'] != 'mongos']
+    self.assertRefused(config, 'every mongos of the sc sharded cluster', liveHosts = live, replicaSetNames = ['cs0', 'sh0'], shardedClusterNames = ['sc'])
+
+  def test_mongos_scale_down(self):
+    config = shardedConfig()
+    live = [p['hostname'] for p in config['processes'] if p['hostname'] != 'ms-1.mongodb.local']
+    pruned = omCommon.pruneMembers(copy.deepcopy(config), liveHosts = live, replicaSetNames = ['cs0', 'sh0'], shardedClusterNames = ['sc'])
+    self.assertEqual(hostnames(pruned)['processes'], sorted(live))
+    self.assertNotIn('ms-1.mongodb.local', hostnames(pruned)['monitoring'])
+
+if __name__ == '__main__':
+  unittest.main()
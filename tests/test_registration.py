@@ -0,0 +1,77 @@
+import copy
+import deployer
+import unittest
+from helpers import BASE_CONFIG, emptyConfig
+
+def register(currentConfig, hosts):
+  hostConfigs = deployer.buildMembers(iConfig = copy.deepcopy(BASE_CONFIG), hosts = hosts)
+  return deployer.memberMutation(hostConfigs)(currentConfig)
+
+class TestBatchRegistration(unittest.TestCase):
+  def assertUnique(self, config, count):
+    names = [process['name'] for process in config['processes']]
+    memberIds = [member['_id'] for member in config['replicaSets'][0]['members']]
+    self.assertEqual(len(names), count)
+    self.assertEqual(len(set(names)), count)
+    self.assertEqual(len(set(memberIds)), count)
+    self.assertEqual(sorted(member['host'] for member in config['replicaSets'][0]['members']), sorted(names))
+
+  # more than 11 hosts, so string sorted suffixes (`rs0_10` < `rs0_9`) would collide
+  def test_ordinal_range(self):
+    config = register(emptyConfig(), ['mongod-0-%s.mongod-0-svc.mongodb.svc.cluster.local' % i for i in range(30)])
+    self.assertUnique(config, 30)
+
+  def test_hosts_without_ordinals(self):
+    config = register(emptyConfig(), ['mongod%s.mongodb.local' % chr(ord('a') + i) for i in range(15)])
+    self.assertUnique(config, 15)
+
+  def test_added_to_existing_statefulset(self):
+    config = register(emptyConfig(), ['mongod-0-%s.mongod-0-svc.mongodb.svc.cluster.local' % i for i in range(12)])
+    config['version'] = 2
+    config = register(config, ['mongod-1-%s.mongod-1-svc.mongodb.svc.cluster.local' % i for i in range(12)] + ['extra.mongodb.local'])
+    self.assertUnique(config, 25)
+
+class TestAllocation(unittest.TestCase):
+  HOSTS = ['mongodb-0-0.mongodb-0-svc.mongodb.svc.cluster.local', 'mongodb-1-0.mongodb-1-svc.mongodb.svc.cluster.local']
+
+  def allocation(self, config):
+    members = dict((member['host'], member['_id']) for member in config['replicaSets'][0]['members'])
+    return dict((process['hostname'], (process['name'], members[process['name']])) for process in config['processes'])
+
+  # deployers of two StatefulSets registering against the same config compute different names and `_id`s
+  def test_same_ordinal_of_different_statefulsets(self):
+    first = self.allocation(register(emptyConfig(), self.HOSTS[:1]))
+    second = self.allocation(register(emptyConfig(), self.HOSTS[1:]))
+    self.assertEqual(first[self.HOSTS[0]][0], 'rs0_mongodb-0-0')
+    self.assertEqual(second[self.HOSTS[1]][0], 'rs0_mongodb-1-0')
+    self.assertNotEqual(first[self.HOSTS[0]][1], second[self.HOSTS[1]][1])
+
+  def test_independent_of_registration_order(self):
+    forward = register(register(emptyConfig(), self.HOSTS[:1]), self.HOSTS[1:])
+    reverse = register(register(emptyConfig(), self.HOSTS[1:]), self.HOSTS[:1])
+    self.assertEqual(self.allocation(forward), self.allocation(reverse))
+
+  # nothing changes, so no new config version is sent
+  def test_restart_keeps_the_allocation(self):
+    config = register(emptyConfig(), self.HOSTS)
+    config['version'] = 2
+    self.assertIsNone(register(config, self.HOSTS[::-1]))
+
+class TestHostList(unittest.TestCase):
+  def hosts(self, *argv):
+    return deployer.hostList(iConfig = BASE_CONFIG, args = deployer.parseArgs(['deployer.py', '--fqdn-template', 'mongod-0-{ordinal}.mongodb.local'] + list(argv)))
+
+  def test_replicas(self):
+    self.assertEqual(self.hosts('--replicas', '2'), ['mongod-0-0.mongodb.local', 'mongod-0-1.mongodb.local'])
+
+  # no hosts would register the machine running the deployer
+  def test_no_replicas(self):
+    with self.assertRaisesRegex(Exception, 'at least'):
+      self.hosts('--replicas', '0')
+
+  def test_empty_ordinal_range(self):
+    with self.assertRaisesRegex(Exception, 'empty'):
+      self.hosts('--ordinals', '3-1')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,55 @@
+import json
+import omSnapshot
+import os
+import shutil
+import tempfile
+import unittest
+
+def config(version):
+  return {'version': version, 'processes': [{'name': 'rs0_%s' % i, 'version': '4.4.%s' % (i + version)} for i in range(20)]}
+
+class TestSnapshotHead(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def heads(self):
+    return [f for f in os.listdir(self.directory) if f.endswith(omSnapshot.HEAD_SUFFIX)]
+
+  def test_head_follows_the_latest_snapshot(self):
+    for version in range(30):
+      snapshot = omSnapshot.save(self.directory, 'h%s' % version, config(version), retention = 10)
+      self.assertEqual(self.heads(), [snapshot + omSnapshot.HEAD_SUFFIX])
+      self.assertEqual(omSnapshot.reconstruct(self.directory), config(version))
+      self.assertLessEqual(len(omSnapshot.history(self.directory)) - 1, 10)
+
+  def test_missing_head_falls_back_to_the_deltas(self):
+    for version in range(3):
+      omSnapshot.save(self.directory, 'h%s' % version, config(version))
+    os.remove(os.path.join(self.directory, self.heads()[0]))
+    omSnapshot.save(self.directory, 'h3', config(3))
+    self.assertEqual(omSnapshot.reconstruct(self.directory), config(3))
+
+class TestDiff(unittest.TestCase):
+  # `1 == True == 1.0` in Python, but they are different documents
+  def test_type_only_changes(self):
+    old = {'members': [{'_id': 0, 'votes': 1, 'priority': 1}], 'tags': [1]}
+    new = {'members': [{'_id': 0, 'votes': True, 'priority': 1.0}], 'tags': [True]}
+    ops = omSnapshot.diff(old, new)
+    self.assertEqual(sorted(op['path'] for op in ops), ['/members/0/priority', '/members/0/votes', '/tags/0'])
+    patched = omSnapshot.patch(json.loads(json.dumps(old)), ops)
+    self.assertEqual(json.dumps(patched), json.dumps(new))
+
+  def test_type_only_change_is_saved(self):
+    directory = tempfile.mkdtemp()
+    try:
+      omSnapshot.save(directory, 'a', {'votes': 1})
+      omSnapshot.save(directory, 'b', {'votes': True})
+      self.assertIs(omSnapshot.reconstruct(directory)['votes'], True)
+    finally:
+      shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import copy
+import deployer
+import omAsync
+import omCommon
+import omMetrics
+import omMock
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from helpers import BASE_CONFIG
+from time import sleep
+
+class TestConcurrentUpdate(unittest.TestCase):
+  def setUp(self):
+    self.mock = omMock.MockOpsManager(projectID = BASE_CONFIG['projectID'], publicKey = BASE_CONFIG['publicKey'], privateKey = BASE_CONFIG['privateKey'])
+    self.mock.start()
+    self.iConfig = dict(BASE_CONFIG, omBaseURL = self.mock.baseurl)
+    self.endpoint = '/groups/' + BASE_CONFIG['projectID'] + '/automationConfig'
+
+  def tearDown(self):
+    self.mock.stop()
+
+  def client(self):
+    return omCommon.Client(baseurl = self.mock.baseurl, ca_cert_path = '/dev/null', privateKey = BASE_CONFIG['privateKey'], publicKey = BASE_CONFIG['publicKey'])
+
+  def mutation(self, fqdn):
+    return deployer.memberMutation(deployer.buildMembers(iConfig = copy.deepcopy(self.iConfig), hosts = [fqdn]))
+
+  # the second writer updates the config between the GET and the PUT of the first, the first is rejected with `409` and re-applied
+  def test_racing_writers_both_survive(self):
+    first = self.mutation('mongod-0-0.mongodb.local')
+    second = self.mutation('mongod-0-1.mongodb.local')
+    raced = []
+
+    def racingFirst(currentConfig):
+      if len(raced) == 0:
+        raced.append(self.client().update(self.endpoint, mutate = second, baseDelay = 0.01))
+      return first(currentConfig)
+
+    reply, requiredConfig, attempts = self.client().update(self.endpoint, mutate = racingFirst, baseDelay = 0.01)
+    self.assertEqual(reply.status_code, 200)
+    self.assertEqual(attempts, 2)
+    self.assertEqual(self.mock.stats()['conflicts'], 1)
+    hostnames = sorted(process['hostname'] for process in self.mock.config['processes'])
+    self.assertEqual(hostnames, ['mongod-0-0.mongodb.local', 'mongod-0-1.mongodb.local'])
+    self.assertEqual(len(self.mock.config['replicaSets'][0]['members']), 2)
+
+  # the asyncio client runs the same retry policy, metrics included
+  def test_async_client_shares_the_retry_policy(self):
+    first = self.mutation('mongod-0-0.mongodb.local')
+    second = self.mutation('mongod-0-1.mongodb.local')
+    raced = []
+    counters = dict(omMetrics.metrics.counters)
+
+    def racingFirst(currentConfig):
+      if len(raced) == 0:
+        raced.append(self.client().update(self.endpoint, mutate = second, baseDelay = 0.01))
+      return first(currentConfig)
+
+    async def update():
+      with ThreadPoolExecutor(max_workers = 2) as executor:
+        omClient = omAsync.AsyncClient(baseurl = self.mock.baseurl, ca_cert_path = '/dev/null', privateKey = BASE_CONFIG['privateKey'], publicKey = BASE_CONFIG['publicKey'], executor = executor)
+        return await omClient.update(self.endpoint, mutate = racingFirst, baseDelay = 0.01)
+
+    reply, requiredConfig, attempts = asyncio.run(update())
+    self.assertEqual(attempts, 2)
+    self.assertEqual(omMetrics.metrics.counters['attempts'] - counters.get('attempts', 0), 3)
+    self.assertEqual(omMetrics.metrics.counters['conflicts'] - counters.get('conflicts', 0), 1)
+    self.assertIn('retrySleep', omMetrics.metrics.phases)
+    self.assertEqual(len(self.mock.config['replicaSets'][0]['members']), 2)
+
+class TestSharedClient(unittest.TestCase):
+  def test_settings_are_part_of_the_key(self):
+    settings = {'baseurl': 'http://localhost:8080/api/public/v1.0', 'ca_cert_path': '/dev/null', 'privateKey': 'PRIVATE', 'publicKey': 'PUBLIC'}
+    plain = omCommon.client(**settings)
+    self.assertIs(omCommon.client(**settings), plain)
+    self.assertIsNot(omCommon.client(timeout = 30, **settings), plain)
+    self.assertIsNot(omCommon.client(compress = True, **settings), plain)
+    limited = omCommon.client(limiter = omCommon.RateLimiter(rate = 5), **settings)
+    self.assertIsNot(limited, plain)
+    self.assertIsNotNone(limited.limiter)
+    self.assertIs(omCommon.client(limiter = omCommon.RateLimiter(rate = 5), **settings), limited)
+
+class TestRateLimiter(unittest.TestCase):
+  def test_lease_outlives_a_slow_slot(self):
+    limiter = omCommon.RateLimiter(concurrency = 1, leaseSecs = 0.3)
+    held = threading.Event()
+    order = []
+
+    def slow():
+      with limiter.slot():
+        held.set()
+        sleep(1)
+        order.append('slow')
+
+    thread = threading.Thread(target = slow)
+    thread.start()
+    held.wait()
+    with limiter.slot():
+      order.append('next')
+    thread.join()
+    self.assertEqual(order, ['slow', 'next'])
+    self.assertEqual(limiter.state['leases'], {})
+
+if __name__ == '__main__':
+  unittest.main()
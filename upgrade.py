@@ -0,0 +1,103 @@
+try:
+  import argparse
+  import deployer
+  import json
+  import omCommon
+  import omMetrics
+  import omSnapshot
+  import sys
+  from time import monotonic
+except ImportError as e:
+  print(e)
+  exit(1)
+
+# Create the mutation that sets the MongoDB version and/or the feature compatibility version of the processes of a wave.
+# The mutation returns `None` if every process is already set
+def waveMutation(names, version = None, featureCompatibilityVersion = None):
+  def mutate(currentConfig):
+    # the `version` is kept, so a wave that raced another change is rejected with `409` and re-applied
+    currentConfig.pop('mongoDbVersions', None)
+    changed = False
+    for process in currentConfig['processes']:
+      if process['name'] not in names:
+        continue
+      if version != None and process['version'] != version:
+        process['version'] = version
+        changed = True
+      if featureCompatibilityVersion != None and process.get('featureCompatibilityVersion') != featureCompatibilityVersion:
+        process['featureCompatibilityVersion'] = featureCompatibilityVersion
+        changed = True
+    if changed == False:
+      return None
+    return currentConfig
+  return mutate
+
+# Plan the waves of the upgrade from the current config, the feature compatibility version is set last, once every binary is upgraded
+def planUpgrade(currentConfig, version, featureCompatibilityVersion, replicaSetNames, shardedClusterNames, mongosWaves):
+  if shardedClusterNames != None:
+    clusters = [c for c in currentConfig['sharding'] if c['name'] in shardedClusterNames]
+    replicaSetNames = [c['configServerReplica'] for c in clusters] + [shard['rs'] for c in clusters for shard in c['shards']]
+  elif replicaSetNames != None:
+    shardedClusterNames = []
+
+  plan = []
+  if version != None:
+    for names in omCommon.upgradeWaves(config = currentConfig, version = version, replicaSetNames = replicaSetNames, shardedClusterNames = shardedClusterNames, mongosWaves = mongosWaves):
+      plan.append({'names': names, 'version': version})
+  if featureCompatibilityVersion != None:
+    names = [m['host'] for r in currentConfig['replicaSets'] if replicaSetNames == None or r['_id'] in replicaSetNames for m in r['members']]
+    names.extend(p['name'] for p in currentConfig['processes'] if p['processType'] == 'mongos' and (shardedClusterNames == None or p.get('cluster') in shardedClusterNames))
+    if any(p['name'] in names and p.get('featureCompatibilityVersion') != featureCompatibilityVersion for p in currentConfig['processes']):
+      plan.append({'names': names, 'featureCompatibilityVersion': featureCompatibilityVersion})
+  return plan
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Upgrade the MongoDB version and feature compatibility version of a project in waves, one PUT per wave')
+  parser.add_argument('--config', default = sys.path[0] + '/config.json', help = 'path of the `config.json` file of the project, defaults to the directory of `upgrade.py`')
+  parser.add_argument('--version', help = 'MongoDB version to upgrade to, e.g. `5.0.3-ent`')
+  parser.add_argument('--fcv', dest = 'featureCompatibilityVersion', help = 'feature compatibility version to set once every process is upgraded, e.g. `5.0`')
+  parser.add_argument('--replica-set', dest = 'replicaSetNames', action = 'append', help = 'replica set to upgrade, can be repeated, defaults to every replica set and mongos')
+  parser.add_argument('--cluster', dest = 'shardedClusterNames', action = 'append', help = 'sharded cluster to upgrade, with its config servers, shards and mongos, can be repeated')
+  parser.add_argument('--mongos-waves', dest = 'mongosWaves', type = int, default = 2, help = 'number of waves the mongos are spread over, defaults to `2`')
+  parser.add_argument('--plan-only', dest = 'planOnly', action = 'store_true', help = 'print the waves without changing anything')
+  args = parser.parse_args()
+  if args.version == None and args.featureCompatibilityVersion == None:
+    parser.error('`--version` and/or `--fcv` is required')
+
+  with open(args.config, 'r') as f:
+    iConfig = json.load(f)
+  omClient = deployer.omClientFor(iConfig)
+  endpoint = '/groups/' + iConfig['projectID'] + '/automationConfig'
+
+  currentConfig = omClient.get(endpoint, skip = ['mongoDbVersions'])
+  hostnames = dict((p['name'], p['hostname']) for p in currentConfig['processes'])
+  plan = planUpgrade(currentConfig, version = args.version, featureCompatibilityVersion = args.featureCompatibilityVersion,
+    replicaSetNames = args.replicaSetNames, shardedClusterNames = args.shardedClusterNames, mongosWaves = args.mongosWaves)
+  for i, wave in enumerate(plan):
+    change = 'version %s' % wave['version'] if 'version' in wave else 'featureCompatibilityVersion %s' % wave['featureCompatibilityVersion']
+    print("Wave %s: %s on %s" % (i + 1, change, ', '.join(wave['names'])))
+  if len(plan) == 0:
+    print("Nothing to upgrade")
+  if args.planOnly:
+    return
+
+  start = monotonic()
+  try:
+    for i, wave in enumerate(plan):
+      mutate = waveMutation(names = wave['names'], version = wave.get('version'), featureCompatibilityVersion = wave.get('featureCompatibilityVersion'))
+      reply, requiredConfig, attempts = omClient.update(endpoint = endpoint, mutate = mutate, attempts = iConfig.get('retryAttempts', 5), deadline = iConfig.get('retryDeadlineSecs'), skip = ['mongoDbVersions'])
+      if reply == None:
+        continue
+      omSnapshot.saveAsync(directory = deployer.snapshotDir(iConfig), name = 'upgrade', config = requiredConfig, retention = iConfig.get('snapshotRetention', 50))
+
+      # the next wave only starts once this one is applied
+      with omMetrics.metrics.phase('goalState'):
+        latencies = omClient.waitForGoalState(endpoint = '/groups/' + iConfig['projectID'] + '/automationStatus', deadline = iConfig.get('goalStateTimeoutSecs', 600),
+          hostnames = [hostnames[name] for name in wave['names'] if name in hostnames])
+      print("Wave %s of %s reached goal state in %.1fs" % (i + 1, len(plan), max(latencies.values() or [0])))
+    print("Upgrade completed in %.1fs" % (monotonic() - start))
+  finally:
+    omMetrics.metrics.gauge('waves', len(plan))
+    deployer.writeMetrics([dict(iConfig, hostname = 'upgrade')])
+
+if __name__ == "__main__": main()